@@ -5,17 +5,20 @@ from tkinter import filedialog
 
 # Custom imports
 import iumsutils           # library of functions specific to my "-IUMS" class of IMS Neural Network applications
-import plotutils           # library of custom plotting utilites which greatly simplify result output
+import plotutils           # library of custom plotting utilites which greatly simplify result output (matplotlib is only loaded on first plot)
 import TimTkLib as ttl     # library of custom tkinter widgets I've written to make GUI assembly more straightforward
+import profutils           # opt-in stage timing and profiling instrumentation
+import trainutils          # built-in classifiers, for producing .nnr results without NeuralWare
 
 # Builtin imports (expect for matplotlib)
-import json, os
+import json, os, sys
 from pathlib import Path
    
 class NIOBIUMS_App:
     '''NIOBIUMS = NeuralWare I/O Bookend Interface for Unlabelled Mobility Spectra'''
     default_paths = {'data_path' : Path('Spectral Datasets'),
                      'result_path' : Path('Training Files')} # Configure names of default folders here
+    result_compression = '' # set to '.gz', '.xz', or '.bz2' to compress label and result files (NeuralWare learn/test files are never compressed)
 
     def __init__(self, main):
         self.main = main
@@ -37,6 +40,7 @@ class NIOBIUMS_App:
         self.families       = []
         self.family_mapping = {}
         self.species_count  = {}
+        self.species_stats  = {}
         
         for path_type, path in self.default_paths.items(): # on creation, reference class-wide default paths to set up folders
             path.mkdir(exist_ok=True)
@@ -44,16 +48,19 @@ class NIOBIUMS_App:
         
         self.data_frame  = ttl.ToggleFrame(self.main, text='Select Data File to Read: ', padx=6, pady=5, row=0)     
         
+        self.catalog     = iumsutils.DatasetCatalog(self.data_path) # cached dataset headers, so datasets needn't be loaded just to be listed or described
         self.chosen_file = tk.StringVar()
-        self.json_menu   = ttl.DynOptionMenu(self.data_frame, var=self.chosen_file, option_method=iumsutils.get_by_filetype,
-                                           opargs=('.json', self.data_path), default='--Choose a JSON--', width=28, colspan=2)
+        self.json_menu   = ttl.DynOptionMenu(self.data_frame, var=self.chosen_file, option_method=self.catalog.names, default='--Choose a JSON--', width=28, colspan=2)
         self.read_label     =  tk.Label(self.data_frame, text='Read Status:')
         self.read_status    = ttl.StatusBox(self.data_frame, on_message='JSON Read!', off_message='No File Read', default_status=False, row=1, col=1)
         self.refresh_button = tk.Button(self.data_frame, text='Refresh JSONs', underline=2, command=self.json_menu.update, padx=12)
         self.confirm_button = ttl.ConfirmButton(self.data_frame, padx=2, underline=0, command=self.import_data, row=1, col=2)
+        self.data_info      = tk.Label(self.data_frame, text='', anchor='w')
+        self.chosen_file.trace_add('write', lambda *args : self.data_info.configure(text=self.catalog.describe(self.chosen_file.get())))
         
         self.refresh_button.grid(row=0, column=2)
         self.read_label.grid(row=1, column=0)
+        self.data_info.grid(row=2, column=0, columnspan=3, sticky='w')
         
     #Frame 2
         self.species_frame = ttl.ToggleFrame(self.main, text='Set Learn/Test File Parameters:', padx=12, pady=5, row=1)      
@@ -78,15 +85,20 @@ class NIOBIUMS_App:
         self.progress_label = tk.Label(self.plotting_frame, text='Plotting Progress: ')
         self.progress       = ttl.NumberedProgBar(self.plotting_frame, maximum=100, length=220, default=0, row=1, col=1)
         self.plot_button    = tk.Button(self.plotting_frame, text='Plot Training Results', padx=109, underline=0, bg='deepskyblue2', command=self.plot_nnr)
+        self.classifier     = tk.StringVar(value='softmax')
+        self.classifier_menu = tk.OptionMenu(self.plotting_frame, self.classifier, *trainutils.classifiers)
+        self.train_button   = tk.Button(self.plotting_frame, text='Train Built-in Classifier', padx=2, underline=0, command=self.train_builtin)
         
         self.species_label.grid( row=0, column=0)
         self.curr_species.grid(  row=0, column=1, sticky='w')
         self.progress_label.grid(row=1, column=0)
         #NumberedProgBar is already gridded
         self.plot_button.grid(   row=2, column=0, columnspan=2,sticky='e')
+        self.classifier_menu.grid(row=3, column=0, sticky='w')
+        self.train_button.grid(  row=3, column=1, sticky='e')
         
     #Misc/Other
-        self.arrays = ('chem_data', 'species', 'families', 'family_mapping', 'unfamiliars', 'species_count') # name reference so attributes, rather than copies, clear on reset
+        self.arrays = ('chem_data', 'species', 'families', 'family_mapping', 'unfamiliars', 'species_count', 'species_stats') # name reference so attributes, rather than copies, clear on reset
         self.frames = (self.data_frame, self.species_frame, self.plotting_frame)
         self.main.bind('<Key>', self.key_in_input) # activate internal conditional hotkey binding
         self.isolate(self.data_frame)
@@ -136,8 +148,11 @@ class NIOBIUMS_App:
             elif event.char == 'u':
                 self.unfamiliar_check.select()
                 self.further_sel()
-        elif self.plotting_frame.state == 'normal' and event.char == 'p': # do not allow hotkeys to work if frame is disabled
-            self.plot_nnr()
+        elif self.plotting_frame.state == 'normal': # do not allow hotkeys to work if frame is disabled
+            if event.char == 'p':
+                self.plot_nnr()
+            elif event.char == 't':
+                self.train_builtin()
     
     def reset(self):
         '''Reset the menu and internal variables to their original state'''   
@@ -165,8 +180,8 @@ class NIOBIUMS_App:
         if self.chosen_file.get() == '--Choose a JSON--':
             messagebox.showerror('File Error', 'No JSON selected')
         else:
-            self.data_file = Path(self.data_path/f'{self.chosen_file.get()}.json')
-            json_data = iumsutils.load_chem_json(self.data_file)
+            self.data_file = iumsutils.resolve_data_path(self.data_path/f'{self.chosen_file.get()}.json') # locates compressed versions too
+            json_data = iumsutils.load_chem_json(self.data_file, compact=True) # array-backed instances, to keep the GUI's memory footprint down
             
             for field_name in self.arrays:
                 if json_data.get(field_name): # this qualifier is here to exclude "unfamiliars", which is in arrays bu tis not a field in json data files
@@ -182,35 +197,19 @@ class NIOBIUMS_App:
         if self.select_unfams.get():
             ttl.SelectionWindow(self.main, self.species_frame, self.species, self.unfamiliars, ncols=8)
     
+    @profutils.instrumented('splitting')
     def separate_and_write(self):
         '''Separate the chem_data, based on the users selection of unfamiliars and split proportion, and write to test and learn files'''
         split_prop = self.split_prop_entry.get_value()
         split_complement = round(1 - split_prop, 4)   # rounding to 4 places should avoid float error for typical proportions (noted here for future debugging)
-         
-        species_to_keep = {species : iumsutils.random_partitioner(1 if species in app.unfamiliars else split_complement, count) # create iterators to randomly partition
-                                 for species, count in app.species_count.items()} # each species among the learn and test files, with the proportion specified
         
         training_desc = (self.select_unfams.get() and f'No {", ".join(self.unfamiliars)}' or 'Control Run') # create informative string about the set     
-        self.file_dir = self.result_path/self.data_file.stem/f'{split_prop}-{split_complement} split, {training_desc}'
+        self.file_dir = self.result_path/iumsutils.data_stem(self.data_file)/f'{split_prop}-{split_complement} split, {training_desc}'
         self.prepare_folder(self.file_dir) # file management to ensure a file exists
    
-        learn_labels, test_labels = [], []
-        with open(self.file_dir/'TTT_testfile.txt', 'w') as test_file, open(self.file_dir/'LLL_learnfile.txt', 'w') as learn_file:    
-            for instance in self.chem_data:               
-                stringy_data = map(str, [*instance.spectrum, *instance.vector])  # unpack the data into a single long list of strings
-                formatted_entry = '\t'.join(stringy_data) + '\n' #f'!{instance.name}\n' # tab-separate the data and append the name as a comment (!-delimited) with newline
-
-                if next(species_to_keep[instance.species]):  # pull out terms from random bool iter assigned to each instance to determine where to place it
-                    test_labels.append(instance.name)
-                    test_file.write(formatted_entry)
-                    self.species_count[instance.species] -= 1
-                else:
-                    learn_labels.append(instance.name)
-                    learn_file.write(formatted_entry) 
-                               
-        with open(self.file_dir/'Test Labels.json', 'w') as test_labels_file, open(self.file_dir/'Learn Labels.json', 'w') as learn_labels_file: 
-            json.dump(test_labels, test_labels_file)    # write the labels associated with each file to jsons for records and later access if replotting
-            json.dump(learn_labels, learn_labels_file)
+        learn_labels, test_labels = iumsutils.split_and_write(self.chem_data, self.file_dir, split_prop, unfamiliars=self.unfamiliars, label_compression=self.result_compression)
+        for inst_name in test_labels:
+            self.species_count[iumsutils.isolate_species(inst_name)] -= 1
         messagebox.showinfo('File Creation Successful!', f'Files can be found in "{self.result_path.name}" folder\n\nPlease perform training, then proceed to plotting')
         
         self.isolate(self.plotting_frame)
@@ -227,27 +226,23 @@ class NIOBIUMS_App:
         self.progress.increment()
         self.main.update()
     
+    def train_builtin(self):
+        '''Train one of the built-in classifiers on the current split in place of NeuralWare, writing its predictions to the .nnr which plotting reads'''
+        if not Path(self.file_dir/'LLL_learnfile.txt').exists():
+            messagebox.showerror('No Learn File Present!', 'Please perform splitting before attempting training')
+            return
+        
+        self.curr_species.configure(text=f'Training ({self.classifier.get()})...')
+        self.main.update()
+        accuracy = trainutils.train_and_predict(self.file_dir, len(self.family_mapping), classifier=self.classifier.get())
+        self.curr_species.configure(text='---')
+        messagebox.showinfo('Training Complete!', f'Test accuracy (by family): {100*accuracy:.1f}%\n\nProceed to plotting')
+    
     def read_and_label_predictions(self):
         '''Reads in the assigned prediction values from the nnr, matches them to the names in the labels file, returns a zipped list of both'''
-        predictions = {}
-        with open(self.file_dir/'TTT_testfile_txt.nnr', 'r') as result_file, open(self.file_dir/'Test Labels.json', 'r') as test_labels_file:         
-            for row, inst_name in zip(result_file, json.load(test_labels_file)):
-                readable_row = [float(i) for i in row.split('\t')[1:]] # get rid of tabs, newlines, and other NW garbage output and convert to numerical values #ANCHOR
-                vector = [int(i) for i in readable_row[:len(self.family_mapping)]]      
-                aavs   = readable_row[len(self.family_mapping):]
-
-                species, family = iumsutils.isolate_species(inst_name), iumsutils.get_family(inst_name)
-                if self.family_mapping[family] != vector:
-                    raise ValueError(f'NeuralWare has mislabelled {inst_name} ({vector} rather than {self.family_mapping[family]})')
-
-                if not predictions.get(family): # ensure family key exists
-                    predictions[family] = {}
-                if not predictions[family].get(species): # ensure species key exists
-                    predictions[family][species] = {}
-                predictions[family][species][inst_name] = aavs # write predictions values to appropriate place in hierarchy
-        
-        return predictions
+        return iumsutils.read_predictions(self.file_dir, self.family_mapping)
       
+    @profutils.instrumented('plotting')
     def plot_nnr(self):
         #Method used to process and plot the test data from the .nnr after training
         if not Path(self.file_dir/'TTT_testfile_txt.nnr').exists(): 
@@ -264,43 +259,55 @@ class NIOBIUMS_App:
         predictions = self.read_and_label_predictions()
         self.progress.set_max(len(self.species)+1) # number of plots, plus the summaries (fermi plots and scores), hence + 1
         
-        score_path = result_dir/'Scores.csv'
-        score_path.touch()
-        with score_path.open('w') as score_file:
+        run_scores = {} # species-wise scores for this run, to be added to the dataset-wide table of scores across runs
+        score_lines = [] # scores are collected and written once at the end, rather than holding a file open through the render loop
+        with iumsutils.AsyncWriter() as writer: # figures are encoded and written in the background while the next species is rendered
             for family, species_dat in predictions.items():
-                score_file.write(family)
+                score_lines.append(family)
                 hotbit = self.family_mapping[family].index(1) # deduce hotbit from mapping and current species
                 
                 fam_scores = []
                 for species, inst_dat in species_dat.items():
                     self.set_next_species(species) # remember to increment progressbar and update the current species
-                    is_unfamiliar = species in self.unfamiliars
                     
                     panel = plotutils.Multiplot(nrows=2, span=3) # create the panel 
-                    spectra = [instance.spectrum for instance in self.chem_data if instance.species == species] # pull out the spectra for the current species
-
-                    panel.draw(plotutils.PWA_Plot(spectra, species), 0)
+                    if species in self.species_stats: # use the precomputed point-wise aggregates if the dataset provides them
+                        panel.draw(plotutils.PWA_Plot(None, species, stats=self.species_stats[species]), 0)
+                    else:
+                        spectra = [instance.spectrum for instance in self.chem_data if instance.species == species] # pull out the spectra for the current species
+                        panel.draw(plotutils.PWA_Plot(spectra, species), 0)
                     panel.draw(plotutils.Species_RC(predictions, species), 1)
                      
                     fermi_plot = plotutils.Fermi_Plot(predictions, species, hotbit) # fermi plot not created in-place in order to extract the score
                     panel.draw(fermi_plot, 2)
                     
-                    panel.save(result_dir/species, close=not is_unfamiliar) # don't close the plot if the current species is an unfamiliar                   
-                    if is_unfamiliar: # also plot the species' result in a shared folder if unfamiliar
-                        panel.save(unfam_dir/species)  # make a copy of the results in a shared, accessible folder, close out plot
+                    copies = (species in self.unfamiliars and [unfam_dir/species] or []) # also plot unfamiliar species' results in a shared, accessible folder
+                    panel.save(result_dir/species, writer=writer, copies=copies)
                     
-                    score_file.write(f'\n{species}, {fermi_plot.score}')
+                    score_lines.append(f'{species}, {fermi_plot.score}')
                     fam_scores.append(fermi_plot.score)
-                score_file.write(f'\nAVERAGE, {iumsutils.average(fam_scores)}')
-                score_file.write('\n\n') # leave a gap between each family
+                    run_scores[species] = fermi_plot.score
+                score_lines.append(f'AVERAGE, {iumsutils.average(fam_scores)}\n') # leave a gap between each family
+            writer.write_text(result_dir/f'Scores.csv{self.result_compression}', '\n'.join(score_lines) + '\n')
 
-        self.set_next_species('Summaries') 
-        plotutils.single_plot(plotutils.Overlaid_Family_RC(predictions), result_dir/'Overall Summary', figsize=8)
-        
-        pred_path = result_dir/'Predictions.json'
-        pred_path.touch()
-        with pred_path.open('w') as pred_file: # save the hierarchically-organized predictions to a local file
-            json.dump(predictions, pred_file)
+            def update_score_table(): # one column per run, appended without rewriting earlier runs
+                score_table = iumsutils.ResultsTable(self.file_dir.parent/'Score Table.jsonl')
+                if 'Species' not in score_table:
+                    score_table.add_column('Species', sorted(self.species))
+                score_table.add_column(self.file_dir.name, [run_scores.get(species, '') for species in score_table['Species']], replace=True)
+                score_table.to_csv(self.file_dir.parent/'Score Table.csv')
+            writer.submit(update_score_table, description='"Score Table.csv"')
+            
+            self.set_next_species('Summaries') 
+            plotutils.single_plot(plotutils.Overlaid_Family_RC(predictions), result_dir/'Overall Summary', figsize=8, writer=writer)
+            writer.write_json(result_dir/f'Predictions.json{self.result_compression}', predictions) # save the hierarchically-organized predictions to a local file
+            
+            self.curr_species.configure(text='Finishing writes...')
+            self.main.update()
+            write_errors = writer.barrier(raise_errors=False) # all output must be on disk (or have failed) before the run is reported complete
+            
+        if write_errors:
+            messagebox.showerror('Write Errors', '\n'.join(f'{description} : {error}' for description, error in write_errors))
     
         self.lift()
         self.curr_species.configure(text='Plotting Complete')
@@ -311,4 +318,13 @@ class NIOBIUMS_App:
 if __name__ == '__main__':        
     main_window = tk.Tk()
     app = NIOBIUMS_App(main_window)
-    main_window.mainloop()
+    
+    if '--profile' in sys.argv: # opt-in instrumentation; stage timings are shown in the GUI and traced to file, and the whole session is run under cProfile
+        stage_status = tk.Label(main_window, text='Profiling enabled', anchor='w')
+        stage_status.grid(row=3, column=0, columnspan=2, sticky='w')
+        profutils.Instrumentation.enable(profutils.StatusSink(stage_status), profutils.JSONTraceSink('NIOBIUMS Trace.jsonl'))
+        with profutils.profiling(stats_path='NIOBIUMS.prof'):
+            main_window.mainloop()
+        print(profutils.Instrumentation.summary())
+    else:
+        main_window.mainloop()
@@ -3,8 +3,6 @@ Widgets, in the order they appear, are ConfirmButton, StatusBox, DynOptionMenu,
 NumberedProgBar, LabelledEntry, Switch, GroupableCheck, CheckPanel, and SelectionWindow'''
 import tkinter as tk
 import tkinter.ttk as ttk
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 
 class ConfirmButton: 
@@ -317,6 +315,9 @@ class SelectionWindow:
 class DynamicPlot:
     def __init__(self, main, title, xlabel, ylabel, x_default=100, y_default=1, figsize=5, dpi=45, line_color='r', row=0, col=0, rs=1, cs=1):
         '''A matplotlib plot embedded in a TK window which can efficiently plot and update lines through arbitrary point'''
+        import matplotlib.pyplot as plt # matplotlib is only imported once a plot is needed, as it is slow to load and no other widgets use it
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        
         self.fig = plt.figure(figsize=(figsize, figsize), dpi=dpi)       
         self.plot_window = FigureCanvasTkAgg(self.fig, main)
         self.plot_window.get_tk_widget().grid(row=row, column=col, rowspan=rs, columnspan=cs)
@@ -333,6 +334,7 @@ class DynamicPlot:
         self.reset()
         
     def __del__(self):
+        import matplotlib.pyplot as plt # already loaded by __init__, so this is just a lookup
         plt.close() # close figure upon destruction (mainly applies to IPython window)
     
     def redraw(self):
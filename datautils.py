@@ -1,10 +1,12 @@
 import json, math, random
-import numpy as np # at some point, consider replacing all data-wide spectral operations with numpy for spped and cleanliness
 from pathlib import Path
+from profutils import instrumented
 
 from iumsutils import *
 from plotutils import *
 
+np = lazy_import('numpy') # at some point, consider replacing all data-wide spectral operations with numpy for spped and cleanliness
+
 
 indicators = { # registry of the indicators being used for various transforms for reference, to be used to prevent collisions
     'roundize' : 'R', # method names as keys   
@@ -19,22 +21,52 @@ indicators = { # registry of the indicators being used for various transforms fo
     'name_filterize' : 'N',
     'inv_fourierize' : 'IFT<cutoff>',
     'mode1_filterize' : 'SM1<norm_range>',
+    'norm_filterize' : 'SN<norm_range>',
     'fourier_filterize' : 'SFT<cutoff>',
     'intensity_filterize' : 'I<cutoff>',
-    'baseline_standardize' : 'B<baseval>'    
+    'baseline_standardize' : 'B<baseval>',
+    'rolling_baselinize' : 'BR<window>',
+    'polynomial_baselinize' : 'BP<order>',
+    'outlier_filterize' : 'O<method><threshold>',
+    'pcaize' : 'PCA<n_components>',
+    'dedupize' : 'DD',
+    'alignize' : 'A<mode>',
+    'resamplize' : 'RS<factor><method> or RSI<size>'
 }
 
 # data transformation methods (for jsons only). NOTE: actual transforms will always end in the suffiz "-ize", while any helper methods will not
-def base_transform(source_path, operator=None, discriminator=lambda x : False, indicator='', **opargs):
+omit_none = lambda instance : False # default discriminator, which keeps every instance
+
+@instrumented('transform')
+def base_transform(source_path, operator=None, discriminator=omit_none, indicator='', batch_operator=None, selector=None, dtype=None, chunk_size=None, metadata=None, **opargs):
     '''The base method for transforming data, takes a .json data file name, an optional operator to modify spectra (takes spectra and optional arguments),
     an optional discriminator to omit spectra if some condition is met (takes an Instance object and the full chem_data list as arguments), 
-    and an optional indicator to denote that a tranform has occurred. NOTE: tranformed data is written to a new file, ORIGINAL DATA IS READ ONLY'''
-    json_data = load_chem_json(source_path)
+    and an optional indicator to denote that a tranform has occurred, and returns the path to the transformed data. Alternatively, a batch operator can be passed which takes the 2D array of all
+    (kept) spectra and optional arguments and returns the transformed array, avoiding per-spectrum Python calls for array-wise operations.
+    A selector may also be given, which takes the loaded data and returns a keep-mask (sequence of bools) over chem_data, for when the choice of
+    spectra to omit depends on whole-dataset information. If a dtype is given (e.g. "float32"), the data are loaded, transformed and written at that 
+    precision, as they are if the dataset already records a dtype. If a chunk size is given, the transform is performed out-of-core (see chunked_transform()).
+    Any fields in "metadata" (a dict) are added to (or replace those in) the top level of the output file.
+    NOTE: tranformed data is written to a new file, ORIGINAL DATA IS READ ONLY'''
+    if chunk_size:
+        if selector:
+            raise ValueError('Selectors require the whole dataset in memory; compute the selection in a preliminary pass and pass a discriminator instead')
+        return chunked_transform(source_path, operator=operator, discriminator=discriminator, indicator=indicator, batch_operator=batch_operator, 
+                                 dtype=dtype, chunk_size=chunk_size, metadata=metadata, **opargs)
+    
+    json_data = load_chem_json(source_path, dtype=dtype)
+    if selector: # selection is made over the same loaded data which is transformed, so the file needn't be read twice
+        json_data['chem_data'] = [instance for instance, keep in zip(json_data['chem_data'], selector(json_data)) if keep]
+        
     json_data['chem_data'] = [
         (operator and instance._replace(spectrum = operator(instance.spectrum, **opargs)) or instance) # operate on the spectrum if an operator is given   
             for instance in json_data['chem_data']
                 if not discriminator(instance)] # omit instance when discriminator condition is met
     
+    if batch_operator: # operate over all spectra at once; the resulting rows are kept as arrays until serialization
+        spectra = batch_operator(np.array([instance.spectrum for instance in json_data['chem_data']], dtype=json_data.get('dtype', 'float64')), **opargs)
+        json_data['chem_data'] = [instance._replace(spectrum=spectrum) for instance, spectrum in zip(json_data['chem_data'], spectra)]
+    
     # takes size to be that of the last spectrum (jsonize guarantees uniform length, unchanged by uniform transformation )
     json_data['spectrum_size'] = len(json_data['chem_data'][-1].spectrum)
     
@@ -47,72 +79,320 @@ def base_transform(source_path, operator=None, discriminator=lambda x : False, i
             for i, instance in enumerate(json_data['chem_data']):
                 json_data['chem_data'][i] = instance._replace(vector = json_data['family_mapping'][instance.family]) # reassign mapping vectors based on the new mapping     
     
+    json_data.update(metadata or {})
+    json_data['lineage'] = json_data.get('lineage', name_lineage(source_path)) + [indicator] # record of all transforms which have been applied, in order
+    json_data['species_stats'], json_data['family_stats'] = dataset_stats(json_data['chem_data'], dtype=json_data.get('dtype')) # spectra have changed, so aggregates must be recomputed
+    
     source_path = sanitized_path(source_path) # ensure Pathlike object pointing to json
-    dest_path = source_path.parent/f'{source_path.stem}{indicator}.json'
+    dest_path = derived_path(source_path, indicator) # output is compressed in the same way as the source, if at all
     dest_path.touch()
-    with dest_path.open(mode='w') as dest_file: # this comment is a watermark - 2020, timotej bernat
-        json.dump(json_data, dest_file) # dump the result in the new file
+    with open_data(dest_path, mode='w') as dest_file: # this comment is a watermark - 2020, timotej bernat
+        json.dump(json_data, dest_file, default=serialized) # dump the result in the new file
+    return dest_path
+
+def chunked_transform(source_path, operator=None, discriminator=omit_none, indicator='', batch_operator=None, dtype=None, chunk_size=1000, metadata=None, **opargs):
+    '''Out-of-core equivalent of base_transform(), for datasets too large to be held in memory (twice over). Instances are streamed from the source
+    through the operators and discriminator in blocks of "chunk_size" and written out incrementally, so only one block is ever held at a time.
+    When instances are omitted, a preliminary streaming pass determines which families remain, so that the family mapping is known before 
+    any vectors are written. Summary statistics are accumulated along the way (quantiles, which require the whole dataset, are omitted)'''
+    source_path = sanitized_path(source_path) # ensure Pathlike object pointing to json
+    header = read_chem_header(source_path) # dtype and family mapping must be known before any instances are processed
+    
+    if discriminator is not omit_none: # preliminary pass, only to find the families which remain once instances have been omitted
+        kept_families = {instance.family for chunk in iter_chem_chunks(source_path, chunk_size, dtype=dtype, header=dict(header)) 
+                                             for instance in chunk if not discriminator(instance)}
+        if kept_families != set(header['family_mapping']): # if the families present have changed, must redo the family mapping as well
+            header['family_mapping'] = one_hot_mapping(sorted(kept_families))
+    
+    species_list, family_list = [], []
+    species_stats, family_stats = {}, {}
+    header['spectrum_size'] = 0
+    dest_path = derived_path(source_path, indicator) # output is compressed in the same way as the source, if at all
+    dest_path.touch()
+    with open_data(dest_path, mode='w') as dest_file:
+        dest_file.write('{"chem_data": [')
+        first = True
+        for chunk in iter_chem_chunks(source_path, chunk_size, dtype=dtype, header=dict(header)):
+            chunk = [(operator and instance._replace(spectrum = operator(instance.spectrum, **opargs)) or instance) for instance in chunk if not discriminator(instance)]
+            if not chunk:
+                continue
+            if batch_operator:
+                spectra = batch_operator(np.array([instance.spectrum for instance in chunk], dtype=header.get('dtype', dtype or 'float64')), **opargs)
+                chunk = [instance._replace(spectrum=spectrum) for instance, spectrum in zip(chunk, spectra)]
+                
+            chunk = [instance._replace(vector = header['family_mapping'][instance.family]) for instance in chunk]
+            header['spectrum_size'] = len(chunk[-1].spectrum) # takes size to be that of the last spectrum, as base_transform() does
+            update_grouped_stats(species_stats, [instance.species for instance in chunk], [instance.spectrum for instance in chunk])
+            update_grouped_stats(family_stats,  [instance.family for instance in chunk],  [instance.spectrum for instance in chunk])
+            for instance in chunk:
+                species_list.append(instance.species)
+                family_list.append(instance.family)
+                dest_file.write(('' if first else ', ') + json.dumps(list(instance), default=serialized))
+                first = False
+        
+        header['species'], header['species_count'] = ordered_and_counted(species_list)
+        header['families'], header['family_count'] = ordered_and_counted(family_list)
+        header.update(metadata or {})
+        header['lineage'] = header.get('lineage', name_lineage(source_path)) + [indicator]
+        if dtype:
+            header['dtype'] = np.dtype(dtype).name
+        header['species_stats'] = {label : running.stats(dtype=header.get('dtype')) for label, running in species_stats.items()}
+        header['family_stats']  = {label : running.stats(dtype=header.get('dtype')) for label, running in family_stats.items()}
+            
+        dest_file.write(']')
+        for field, value in header.items():
+            dest_file.write(f', {json.dumps(field)}: {json.dumps(value, default=serialized)}')
+        dest_file.write('}')
+    return dest_path
+        
+def dataset_minimum(source_path, chunk_size=None):
+    '''Returns the smallest point in any spectrum of a dataset. If a chunk size is given, the dataset is streamed rather than loaded whole'''
+    if not chunk_size:
+        return fold(load_chem_json(source_path)['chem_data'], min)
+    return min(np.min([instance.spectrum for instance in chunk]) for chunk in iter_chem_chunks(source_path, chunk_size))
 
 # some basic tranform operations
-def duplicate(source_path):
+def duplicate(source_path, chunk_size=None):
     '''Makes a duplicate of a json dataset in the same directory'''
-    base_transform(source_path, indicator='(D)') # with no operator or discriminator, all items are copied verbatim
+    return base_transform(source_path, indicator='(D)', chunk_size=chunk_size) # with no operator or discriminator, all items are copied verbatim
     
-def truncatize(source_path, cutoff):
+def truncatize(source_path, cutoff, chunk_size=None):
     '''Truncates all spectra below some cutoff'''
-    base_transform(source_path, operator=lambda spectrum : spectrum[:cutoff], indicator='(T)')
+    return base_transform(source_path, operator=lambda spectrum : spectrum[:cutoff], indicator='(T)', chunk_size=chunk_size)
           
-def filterize(source_path, cutoff=0.5): 
+def filterize(source_path, cutoff=0.5, chunk_size=None): 
     '''Removes all spectra whose maximum falls below a specified cutoff value'''
-    base_transform(source_path, discriminator=lambda instance : max(instance.spectrum) < cutoff, indicator='(S)')    
+    return base_transform(source_path, discriminator=lambda instance : max(instance.spectrum) < cutoff, indicator='(S)', chunk_size=chunk_size)    
     
-def roundize(source_path, precision=6):
+def roundize(source_path, precision=6, chunk_size=None):
     '''Rounds all spectral datapoints to the passed number of decimal places (default 6)'''
-    base_transform(source_path, operator=lambda spectrum : [round(i, precision) for i in spectrum], indicator='(R)')
+    return base_transform(source_path, operator=lambda spectrum : [round(i, precision) for i in spectrum], indicator='(R)', chunk_size=chunk_size)
     
-def name_filterize(source_path, species_list):
+def name_filterize(source_path, species_list, chunk_size=None):
     '''Takes a list of species and removes all instances of each species from the dataset'''
-    base_transform(source_path, discriminator=lambda instance : instance.species in species_list, indicator='(N)')
+    return base_transform(source_path, discriminator=lambda instance : instance.species in species_list, indicator='(N)', chunk_size=chunk_size)
+
+
+# baseline correction engine; each method takes the 2D array of spectra (plus its own parameters) and returns the baselines of all spectra at once
+def window_mean_baseline(spectra, lower=0, upper=20):
+    '''Flat baseline at the mean of each spectrum over a noise-only window (rounded as average() rounds, so that results match the original per-point version)'''
+    return np.round(spectra[:, lower:upper].mean(axis=1, keepdims=True), 4)
+
+def rolling_min_baseline(spectra, window=15):
+    '''Baseline from a rolling minimum of each spectrum over a sliding window of "window" points (which must be wider than any peak). The minimum is
+    followed by a rolling maximum (together, a morphological opening, which removes peaks but follows sloped baselines without lagging them) and then
+    by a rolling mean to smooth out the steps the opening leaves. Every pass is a reduction over a strided view of all spectra, rather than a loop'''
+    half = window//2
+    sliding = lambda array, reduction : reduction(np.lib.stride_tricks.sliding_window_view(np.pad(array, ((0, 0), (half, half)), mode='edge'), 2*half + 1, axis=1), axis=2)
+    return sliding(sliding(sliding(spectra, np.min), np.max), np.mean)
+
+def polynomial_baseline(spectra, order=2, n_iter=20):
+    '''Low-order polynomial baseline, fitted iteratively: after each fit, points above the fitted curve (i.e. peaks) are clipped down to it, so the fit
+    settles onto the baseline beneath the peaks (the "modified polyfit" method). All spectra share one Vandermonde matrix over the drift axis, so each
+    iteration is a single least-squares solve, through that matrix's precomputed pseudo-inverse, for every spectrum at once'''
+    vandermonde = np.vander(np.linspace(-1, 1, spectra.shape[1]), order + 1) # drift axis scaled to [-1, 1], to keep the matrix well-conditioned
+    projector = vandermonde @ np.linalg.pinv(vandermonde)
+    working = spectra.copy()
+    for _ in range(n_iter):
+        working = np.minimum(working, working @ projector.T)
+    return working @ projector.T
+
+baselines = {'mean' : window_mean_baseline, 'rolling_min' : rolling_min_baseline, 'polynomial' : polynomial_baseline}
+
+def baseline_correct(spectra, method='mean', base_value=0, **params):
+    '''Batch operator which subtracts the chosen baseline (one of the "baselines", or any function of the same form) from every spectrum and sets it to "base_value"'''
+    baseline = (baselines[method] if type(method) == str else method)(spectra, **params)
+    return spectra - baseline + base_value
 
-def baseline_standardize(source_path, lower=0, upper=20, base_value=0): # if a non-zero baseline is chosen, this will be reflected in the indicator
+def baseline_standardize(source_path, lower=0, upper=20, base_value=0, chunk_size=None): # if a non-zero baseline is chosen, this will be reflected in the indicator
     '''Baseline standardizes a dataset. Takes a spectrum, two bounds, and a desired baseline value and uses the average noise in the region specified between the
     two bounds to center the overall baseline around the desired value. NOTE: it is CRITICAL that the bounds denote a region containing ONLY NOISE (NO PEAKS!)''' 
-    base_transform(source_path, operator=lambda spectrum : [point - average(spectrum[lower:upper]) + base_value for point in spectrum], indicator=f'(B{base_value and base_value or ""})') 
+    return base_transform(source_path, batch_operator=baseline_correct, method='mean', lower=lower, upper=upper, base_value=base_value, 
+                          indicator=f'(B{base_value and base_value or ""})', chunk_size=chunk_size) 
+
+def rolling_baselinize(source_path, window=15, base_value=0, chunk_size=None):
+    '''Subtracts a rolling-minimum baseline (see rolling_min_baseline()) from every spectrum, which follows drifting or sloped baselines that a flat one cannot'''
+    return base_transform(source_path, batch_operator=baseline_correct, method='rolling_min', window=window, base_value=base_value, 
+                          indicator=f'(BR{window}{base_value and f" {base_value}" or ""})', chunk_size=chunk_size)
+
+def polynomial_baselinize(source_path, order=2, n_iter=20, base_value=0, chunk_size=None):
+    '''Subtracts an iteratively fitted low-order polynomial baseline (see polynomial_baseline()) from every spectrum'''
+    return base_transform(source_path, batch_operator=baseline_correct, method='polynomial', order=order, n_iter=n_iter, base_value=base_value, 
+                          indicator=f'(BP{order}{base_value and f" {base_value}" or ""})', chunk_size=chunk_size)
     
 
-# transforms that require helper methods, usually to gain extra info from the whole dataset    
-def norm_index(source_path, operator, lower_bound=0.15, upper_bound=0.95):
-    '''Takes a dataset, an operation to apply over spectra, and normalized cutoff bounds and
-    returns a dict (by species) of the ranges of data falling within those normalized bounds'''  
+# transforms that require helper methods, usually to gain extra info from the whole dataset
+reducers = { # per-instance statistics over which normalized filtering can be performed; each takes the 2D array of spectra and returns one value per spectrum
+    'RIP' : lambda spectra : spectra[:, :spectra.shape[1]//2].max(axis=1), # vectorized analogue of get_RIP()
+    'max' : lambda spectra : spectra.max(axis=1),
+    'RIP_position' : lambda spectra : rip_positions(spectra) # (fractional) drift index of the RIP, see rip_positions()
+}
+
+def reduced(chem_data, reducer):
+    '''Takes a list of Instances and a reducer (either the name of one of the "reducers" or a function of the 2D spectrum array which 
+    returns one value per row), returns an array of the statistic for each instance, computed as a single vector operation'''
+    reducer = reducers[reducer] if type(reducer) == str else reducer
+    return np.asarray(reducer(np.array([instance.spectrum for instance in chem_data], dtype=float)))
+
+def grouped_norm_bounds(values, groups, lower_bound=0.15, upper_bound=0.95):
+    '''Takes an array of values and a parallel array of group labels (e.g. species), min-max normalizes the values within each group and returns
+    the sorted group names, the integer group code of each value, and arrays of the lowest and highest values (by group) whose normalized values
+    lie strictly between the bounds. All operations are grouped vector reductions over a single sort, rather than a scan per group'''
     if not (0 <= lower_bound < 1) or not (0 < upper_bound <= 1): # some error checking to ensure that the imposed limits make sense
         raise ValueError('Limit(s) should be between 0 and 1')
     elif lower_bound > upper_bound:
         raise ValueError('Limits are mismatched')
     
-    json_data = load_chem_json(source_path)  
+    values = np.asarray(values, dtype=float)
+    group_names, codes = np.unique(np.asarray(groups), return_inverse=True)
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0]) # index of the first member of each group, in sorted order
+    reduce_groups = lambda ufunc, data : ufunc.reduceat(data[order], starts)
+    
+    group_min, group_max = reduce_groups(np.minimum, values), reduce_groups(np.maximum, values)
+    span = (group_max - group_min)[codes]
+    norm_values = np.divide(values - group_min[codes], span, out=values.copy(), where=(span != 0)) # as in normalized(), uniform groups keep their raw values
+    in_bounds = (lower_bound < norm_values) & (norm_values < upper_bound)
     
-    bounds = {}
-    for species in json_data['species']:
-        op_spectra = sorted(operator(instance.spectrum)
-                                for instance in json_data['chem_data']
-                                    if instance.species == species) # operate over all instances of a species
-        lower_cutoff, *middle, upper_cutoff = [val for val, norm_val in zip(op_spectra, normalized(op_spectra)) if lower_bound < norm_val < upper_bound] # discard middle values
-        bounds[species] = (lower_cutoff, upper_cutoff)        
-    return bounds
+    if (reduce_groups(np.add, in_bounds.astype(int)) < 2).any(): # need at least two values in bounds to define a range
+        sparse_groups = group_names[reduce_groups(np.add, in_bounds.astype(int)) < 2]
+        raise ValueError(f'Fewer than two values fall within the normalized bounds for {", ".join(map(str, sparse_groups))}')
+    lower_cutoffs = reduce_groups(np.minimum, np.where(in_bounds, values, np.inf))
+    upper_cutoffs = reduce_groups(np.maximum, np.where(in_bounds, values, -np.inf))
+    return group_names, codes, lower_cutoffs, upper_cutoffs
 
-def mode1_filterize(source_path, lower_bound=0.15, upper_bound=0.95):
+def norm_mask(chem_data, reducer, lower_bound=0.15, upper_bound=0.95):
+    '''Returns a keep-mask over a list of Instances of those whose reduced value (see reduced()) lies strictly between the normalized cutoffs for their species'''
+    return bounds_mask(reduced(chem_data, reducer), [instance.species for instance in chem_data], lower_bound, upper_bound)
+
+def bounds_mask(values, groups, lower_bound=0.15, upper_bound=0.95):
+    '''Returns a keep-mask of the values which lie strictly between the normalized cutoffs for their group (see grouped_norm_bounds())'''
+    values = np.asarray(values, dtype=float)
+    group_names, codes, lower_cutoffs, upper_cutoffs = grouped_norm_bounds(values, groups, lower_bound, upper_bound)
+    return (lower_cutoffs[codes] < values) & (values < upper_cutoffs[codes])
+
+def streamed_reduced(source_path, reducer, chunk_size=1000):
+    '''Preliminary streaming pass for out-of-core transforms, returns the names, species and reduced values (see reduced()) of all instances in a dataset'''
+    names, species, values = [], [], []
+    for chunk in iter_chem_chunks(source_path, chunk_size):
+        names.extend(instance.name for instance in chunk)
+        species.extend(instance.species for instance in chunk)
+        values.append(reduced(chunk, reducer))
+    return names, species, np.concatenate(values)
+
+def norm_index(source_path, operator, lower_bound=0.15, upper_bound=0.95, chunk_size=None):
+    '''Takes a dataset, an operation to apply over spectra (a reducer, see reduced()), and normalized cutoff bounds and
+    returns a dict (by species) of the ranges of data falling within those normalized bounds. If a chunk size is given, the data is streamed'''  
+    operator = {max : 'max', get_RIP : 'RIP'}.get(operator, operator) # the scalar functions used historically are mapped to their vectorized equivalents
+    if chunk_size:
+        names, species, values = streamed_reduced(source_path, operator, chunk_size)
+    else:
+        chem_data = load_chem_json(source_path)['chem_data']
+        species, values = [instance.species for instance in chem_data], reduced(chem_data, operator)
+    group_names, codes, lower_cutoffs, upper_cutoffs = grouped_norm_bounds(values, species, lower_bound, upper_bound)
+    return {str(spec) : (lower, upper) for spec, lower, upper in zip(group_names, lower_cutoffs.tolist(), upper_cutoffs.tolist())}
+
+def norm_filterize(source_path, reducer, lower_bound=0.15, upper_bound=0.95, indicator=None, chunk_size=None):
+    '''Culls all spectra whose reduced value (a named reducer or a function over the spectrum array, see reduced()) lies outside of some 
+    prescribed normalized bounds for that statistic within their species. If a chunk size is given, the transform is performed out-of-core'''
+    indicator = indicator or f'(SN {int(lower_bound*100)}-{int(upper_bound*100)})'
+    if not chunk_size:
+        return base_transform(source_path, selector=lambda json_data : norm_mask(json_data['chem_data'], reducer, lower_bound, upper_bound), indicator=indicator)
+    else: # the statistic is gathered in a preliminary streaming pass, from which the instances to keep are found by name
+        names, species, values = streamed_reduced(source_path, reducer, chunk_size)
+        kept_names = {name for name, keep in zip(names, bounds_mask(values, species, lower_bound, upper_bound)) if keep}
+        return base_transform(source_path, discriminator=lambda instance : instance.name not in kept_names, indicator=indicator, chunk_size=chunk_size)
+
+def mode1_filterize(source_path, lower_bound=0.15, upper_bound=0.95, chunk_size=None):
     '''Filtering regime specific to Mode 1, will not work with other Modes, and Mode 1 sets should not be used with other filtering regimes.
     Culls all spectra whose RIP lies outside of some prescribed normalized bounds for the RIP for that particular species'''
     if 'Mode 1' not in str(source_path): # ensure this transform is not applied to data for which it is not compatible
         raise TypeError('File is not a Mode 1 dataset')
-        
-    RIP_cutoffs = norm_index(source_path, get_RIP, lower_bound=lower_bound, upper_bound=upper_bound) # the dictionary of the RIP cutoffs by species
-    base_transform(source_path, discriminator=lambda instance : not (RIP_cutoffs[instance.species][0] < get_RIP(instance.spectrum) < RIP_cutoffs[instance.species][1]), indicator=f'(SM1 {int(lower_bound*100)}-{int(upper_bound*100)})')
+    return norm_filterize(source_path, 'RIP', lower_bound=lower_bound, upper_bound=upper_bound, indicator=f'(SM1 {int(lower_bound*100)}-{int(upper_bound*100)})', chunk_size=chunk_size)
     
-def intensity_filterize(source_path, cutoff=0.3):
+def intensity_filterize(source_path, cutoff=0.3, chunk_size=None):
     '''More sophisticated version of filterize, removes all spectra below some intensity on the basis of a normalized cutoff'''
-    max_cutoffs = norm_index(source_path, max, lower_bound=cutoff, upper_bound=1) # only care about removing those below the cutoff (upper bound will always be 1)
-    base_transform(source_path, discriminator=lambda instance : not (max_cutoffs[instance.species][0] < max(instance.spectrum) < max_cutoffs[instance.species][1]), indicator=f'(I-{int(100*cutoff)})')
+    return norm_filterize(source_path, 'max', lower_bound=cutoff, upper_bound=1, indicator=f'(I-{int(100*cutoff)})', chunk_size=chunk_size) # only care about removing those below the cutoff (upper bound will always be 1)
+
+def grouped_median(values, codes):
+    '''Takes an array of values (1D, or 2D with one row per instance) and an integer group code for each row (as returned by np.unique(return_inverse=True)),
+    returns the median of each group (column-wise for 2D input) from a single sort, rather than a call per group. Each row is offset by its group code 
+    times the range of the data, so that one sort along the first axis orders every group's values within its own block of rows'''
+    values = np.asarray(values, dtype=float)
+    counts = np.bincount(codes)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    offsets = (codes*(np.ptp(values) + 1)).reshape(-1, *[1]*(values.ndim - 1))
+    ordered = np.take_along_axis(values, np.argsort(values + offsets, axis=0), axis=0)
+    return (ordered[starts + (counts - 1)//2] + ordered[starts + counts//2])/2
+
+def grouped_robust_z(values, codes):
+    '''Robust z-scores of values within their groups, based on the median and the (normal-consistent) median absolute deviation of each group. 
+    Values in groups with no spread (beyond rounding error) are given a score of 0'''
+    medians = grouped_median(values, codes)[codes]
+    spreads = 1.4826*grouped_median(np.abs(values - medians), codes)[codes]
+    return np.divide(values - medians, spreads, out=np.zeros_like(values, dtype=float), where=(spreads > 1e-9*np.abs(medians)))
+
+def outlier_statistic(spectra, codes, method='distance', shrinkage=0.1):
+    '''Per-spectrum measure of how atypical each spectrum is of its group (species), using one of the following methods:
+        "distance" : Euclidean distance of the spectrum from its species' mean spectrum
+        "robust" : root-mean-square over all points of the point-wise robust z-scores of the spectrum within its species
+        "mahalanobis" : Mahalanobis distance from the species mean, under the species' covariance shrunk towards a multiple of the identity by the 
+                        "shrinkage" proportion (a species with no more spectra than points has a singular covariance, under which every spectrum is equally distant)'''
+    spectra = np.asarray(spectra, dtype=float)
+    if method == 'robust':
+        return np.sqrt((grouped_robust_z(spectra, codes)**2).mean(axis=1))
+    
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    means = np.add.reduceat(spectra[order], starts)/np.bincount(codes)[:, None]
+    deviations = spectra - means[codes]
+    if method == 'distance':
+        return np.linalg.norm(deviations, axis=1)
+    elif method == 'mahalanobis':
+        if not 0 < shrinkage <= 1:
+            raise ValueError('Shrinkage must be in (0, 1], as an unshrunk covariance cannot distinguish the spectra of small species')
+        statistic = np.zeros(len(spectra))
+        for group_rows in np.split(order, starts[1:]): # covariances are intrinsically per-group, so this is the one unavoidable loop
+            group_devs = deviations[group_rows]
+            eigenvalues, eigenvectors = np.linalg.eigh(group_devs.T @ group_devs/max(len(group_rows) - 1, 1))
+            target = max(eigenvalues.mean(), 0) # the shrinkage target is the identity scaled to the same total variance
+            if target > 0: # otherwise all spectra of the group are identical, and none is an outlier
+                variances = (1 - shrinkage)*np.maximum(eigenvalues, 0) + shrinkage*target
+                statistic[group_rows] = np.sqrt((((group_devs @ eigenvectors)**2)/variances).sum(axis=1))
+                if len(group_rows) > 2 and np.ptp(statistic[group_rows]) <= 1e-9*statistic[group_rows].max(): # a degenerate covariance would make any cull arbitrary
+                    raise ValueError(f'Mahalanobis distances are all equal within a species of {len(group_rows)} spectra; increase the shrinkage')
+        return statistic
+    raise ValueError(f'Unknown outlier method "{method}"; use "distance", "robust" or "mahalanobis"')
+
+def outlier_scores(chem_data, method='distance'):
+    '''Scores every instance against the distribution of its species in one vectorized pass. The score is the robust z-score (within the species) 
+    of the chosen outlier statistic (see outlier_statistic()), so that a single rejection threshold has the same meaning for every method and species'''
+    group_names, codes = np.unique([instance.species for instance in chem_data], return_inverse=True)
+    spectra = np.array([instance.spectrum for instance in chem_data], dtype=float)
+    return grouped_robust_z(outlier_statistic(spectra, codes, method=method), codes)
+
+def outlier_filterize(source_path, threshold=3.5, method='distance', report=None):
+    '''Culls all spectra which are outliers of their species, i.e. whose outlier score (see outlier_scores()) exceeds the threshold (3.5 being the 
+    conventional cutoff for robust z-scores). Catches bad acquisitions whose peak heights are normal, which the scalar filters let through.
+    A report of the culled instances and their scores is written alongside the transformed data as "<name><indicator> Culled.csv", and the 
+    (name, species, score) entries are also appended to "report" if a list is given. Returns the path of the transformed data'''
+    indicator = f'(O{method != "distance" and method[0].upper() or ""}{threshold})'
+    culled = []
+    
+    def selector(json_data):
+        scores = outlier_scores(json_data['chem_data'], method=method)
+        keep = ~(scores > threshold)
+        culled.extend((instance.name, instance.species, score) for instance, score, kept in zip(json_data['chem_data'], scores.tolist(), keep) if not kept)
+        return keep
+    dest_path = base_transform(source_path, selector=selector, indicator=indicator)
+    
+    with open_data(derived_path(source_path, f'{indicator} Culled', ext='.csv'), mode='w', newline='') as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow(('Name', 'Species', f'Score ({method})'))
+        writer.writerows(sorted(culled, key=lambda entry : entry[2], reverse=True))
+    if report is not None:
+        report.extend(culled)
+    return dest_path
     
 
 def get_reduction_listing(source_path, lower_cap=60, upper_cap=80):
@@ -130,63 +410,274 @@ def get_reduction_listing(source_path, lower_cap=60, upper_cap=80):
             kept_count[instance.species] -= 1   
     return kept_listing
 
-def reductize(source_path, lower_cap=60, upper_cap=80):
+def reductize(source_path, lower_cap=60, upper_cap=80, chunk_size=None):
     '''Reduces a dataset such that no species has more than the "upper_cap" amount of instances, in a doubly-random and bias-free way'''
     instances_to_keep = get_reduction_listing(source_path, lower_cap=lower_cap, upper_cap=upper_cap)
-    base_transform(source_path, discriminator=lambda instance : instance.name not in instances_to_keep, indicator='(R--)')
+    return base_transform(source_path, discriminator=lambda instance : instance.name not in instances_to_keep, indicator='(R--)', chunk_size=chunk_size)
+
+def find_duplicates(chem_data, tolerance=1e-6, cell_size=None, n_bands=32, band_size=8, seed=0, block_size=2**16):
+    '''Finds spectra within "tolerance" at every point of an earlier kept spectrum, by hashing randomly offset cells over random bands of points (LSH) 
+    and checking only spectra sharing a bucket. Returns (kept index, duplicate index, largest point-wise difference) for each duplicate'''
+    spectra = np.array([instance.spectrum for instance in chem_data], dtype=float)
+    cell_size = cell_size or 8*tolerance # small enough that only near-duplicates share cells across a band, while true ones almost always do in some band
+    rng = np.random.default_rng(seed)
+    
+    pairs = []
+    for _ in range(n_bands):
+        points = rng.choice(spectra.shape[1], size=min(band_size, spectra.shape[1]), replace=False)
+        cells = np.floor((spectra[:, points] + rng.uniform(0, cell_size, size=len(points)))/cell_size).astype('int64')
+        bucket_ids = np.unique(cells, axis=0, return_inverse=True)[1].ravel()
+        shared = np.flatnonzero(np.bincount(bucket_ids)[bucket_ids] > 1) # spectra alone in their bucket need not be considered further
+        order = shared[np.argsort(bucket_ids[shared], kind='stable')]
+        for bucket in np.split(order, np.flatnonzero(np.diff(bucket_ids[order])) + 1):
+            firsts, others = np.triu_indices(len(bucket), 1)
+            pairs.append(np.stack((bucket[firsts], bucket[others]), axis=1))
+    pairs = np.unique(np.concatenate(pairs or [np.empty((0, 2), dtype=int)]) @ [len(spectra), 1]) # encoded as single integers, which sort far faster than rows
+    pairs = np.stack(np.divmod(pairs, len(spectra)), axis=1)
+    
+    differences = np.concatenate([np.abs(spectra[block[:, 0]] - spectra[block[:, 1]]).max(axis=1) # exact check, in blocks to bound memory
+                                      for block in np.split(pairs, range(block_size, len(pairs), block_size))] or [np.empty(0)])
+    partners = collections.defaultdict(list) # earlier confirmed near-duplicates of each spectrum, in order
+    for first, other, difference in zip(*pairs[differences <= tolerance].T.tolist(), differences[differences <= tolerance].tolist()):
+        partners[other].append((first, difference))
+    
+    duplicates, kept = [], set()
+    for i in range(len(spectra)): # matched against kept spectra only, so that chains of near-duplicates are never merged
+        match = next(((first, difference) for first, difference in partners[i] if first in kept), None)
+        if match:
+            duplicates.append((match[0], i, match[1]))
+        else:
+            kept.add(i)
+    return duplicates
+
+def dedupize(source_path, tolerance=1e-6, drop=True, report=None, **search_args):
+    '''Finds near-duplicate spectra (see find_duplicates()), e.g. the same acquisition exported under two names, and writes a report pairing each 
+    duplicate with the instance kept in its place to "<name>(DD) Duplicates.csv" (the entries are also appended to "report" if a list is given). 
+    If "drop" is set, the duplicates are also removed from the dataset (species and family counts are recounted as for any omission) and the path
+    of the deduplicated data is returned; otherwise only the report is made, and the source path is returned unchanged. As every spectrum must be 
+    compared against all others, the whole dataset is held in memory (there is no chunked mode, as for outlier_filterize())'''
+    chem_data = load_chem_json(source_path)['chem_data']
+    duplicates = [(chem_data[kept].name, chem_data[kept].species, chem_data[dup].name, chem_data[dup].species, difference) 
+                      for kept, dup, difference in find_duplicates(chem_data, tolerance=tolerance, **search_args)]
+    
+    with open_data(derived_path(source_path, '(DD) Duplicates', ext='.csv'), mode='w', newline='') as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow(('Kept', 'Kept Species', 'Duplicate', 'Duplicate Species', 'Max Difference'))
+        writer.writerows(duplicates)
+    if report is not None:
+        report.extend(duplicates)
+        
+    if not drop:
+        return sanitized_path(source_path)
+    duplicate_names = {entry[2] for entry in duplicates}
+    return base_transform(source_path, discriminator=lambda instance : instance.name in duplicate_names, indicator='(DD)')
 
     
 fold = lambda chem_data, funct, **kwargs : funct((funct(instance.spectrum, **kwargs) for instance in chem_data), **kwargs) # useful for finding single smallest point in a dataset, for example
    
-def positivize(source_path): # consider omitting entirely, leads to awkward floating point errors and is questionably useful
-    '''Finds the absolute minimum of a dataset and if it is negative, raises all data points by that value to ensure no values are below 0'''
-    abs_min = fold(load_chem_json(source_path)['chem_data'], min)
+def positivize(source_path, chunk_size=None): # consider omitting entirely, leads to awkward floating point errors and is questionably useful
+    '''Finds the absolute minimum of a dataset and if it is negative, raises all data points by that value to ensure no values are below 0.
+    Returns the path of the raised data, or the source path itself if the data is already positive (in which case nothing is written)'''
+    abs_min = dataset_minimum(source_path, chunk_size=chunk_size)
     if abs_min < 0: # only perform transform if absolute minimum is actually negative
-        base_transform(source_path, operator=lambda spectrum : [i - abs_min for i in spectrum], indicator='(+)')
+        return base_transform(source_path, operator=lambda spectrum : [i - abs_min for i in spectrum], indicator='(+)', chunk_size=chunk_size)
     else:
-        return 'Data already positive'
+        return sanitized_path(source_path)
     
-def logarithmize(source_path):
+def logarithmize(source_path, chunk_size=None):
     '''Finds the absolute minimum point of a baseline-standardized dataset, makes this the new baseline (to ensure all points are positive and avoid a log domain error)
     and takes the natural log over all spectra (exaggerates relative differences even further)'''
     if '(B' not in str(source_path): # consider using regex for this check (numerical value in baseline indicator is variable)
         raise TypeError('Transform must be performed over baseline-standardized data')       
-    chem_data = load_chem_json(source_path)['chem_data']    
-    eps_baseline = -fold(chem_data, min) + np.finfo(float).eps # the minimum non-biased/equitable baseline that guarantees all data are positive    
-    base_transform(source_path, operator=lambda spectrum : [math.log(point + eps_baseline) for point in spectrum], indicator='(L)') 
+    eps_baseline = -dataset_minimum(source_path, chunk_size=chunk_size) + np.finfo(float).eps # the minimum non-biased/equitable baseline that guarantees all data are positive    
+    return base_transform(source_path, operator=lambda spectrum : [math.log(point + eps_baseline) for point in spectrum], indicator='(L)', chunk_size=chunk_size) 
     
     
 # Fourier-Transform transformation methods
-def fourier(spectrum, cutoff=None):                                                      
-    '''Returns the real-valued FFT of a spectrum. Optionally, can clear all frequencies in the transform above some cutoff'''
-    fft_spectrum = np.fft.hfft(spectrum)  # perform a Hermitian (real-valued) fast Fourier transform over the data
+def batch_fourier(spectra, cutoff=None):
+    '''Returns the real-valued FFTs of every row of a 2D array of spectra in a single call. Optionally, can clear all frequencies in the transforms above some cutoff'''
+    fft_spectra = np.fft.hfft(spectra, axis=-1)  # perform a Hermitian (real-valued) fast Fourier transform over the data
     if cutoff:
-        fft_spectrum[cutoff:] = 0   # set everything above the cutoff to 0 (if cutoff is specified) to preserve spectrum size upon inverse tranform
-    return fft_spectrum.tolist() # must return as a list in order to be json serializable
+        fft_spectra[..., cutoff:] = 0   # set everything above the cutoff to 0 (if cutoff is specified) to preserve spectrum size upon inverse tranform
+    return fft_spectra
+
+def batch_inv_fourier(fft_spectra):
+    '''Returns the real-valued inverse transforms of every row of a 2D array of Fourier spectra in a single call'''
+    return np.fft.ihfft(fft_spectra, axis=-1).real
+
+def fourier(spectrum, cutoff=None):                                                      
+    '''Returns the real-valued FFT of a single spectrum. Optionally, can clear all frequencies in the transform above some cutoff'''
+    return batch_fourier(np.asarray(spectrum), cutoff=cutoff).tolist() # must return as a list in order to be json serializable
 
-inv_fourier = lambda spectrum : np.fft.ihfft(spectrum).real.tolist() # returns real-valued inverse thransform as a serializable list
+inv_fourier = lambda spectrum : batch_inv_fourier(np.asarray(spectrum)).tolist() # returns real-valued inverse thransform as a serializable list
 
-def fourierize(source_path, cutoff=None): # if no cutoff is given, will simply yield the full spectra
+def fourierize(source_path, cutoff=None, chunk_size=None): # if no cutoff is given, will simply yield the full spectra
     '''Replaces spectra in a set with their Fourier Tranforms (Hermitian and real-valued)'''
     if '(FT)' in str(source_path):
         raise TypeError('Input cannot already be Fourierized')   
-    base_transform(source_path, operator=fourier, indicator=f'(FT{cutoff and cutoff or ""})', cutoff=cutoff) 
+    return base_transform(source_path, batch_operator=batch_fourier, indicator=f'(FT{cutoff and cutoff or ""})', cutoff=cutoff, chunk_size=chunk_size) 
 
-def inv_fourierize(source_path): # cutoff is list index of highest point to keep
+def inv_fourierize(source_path, chunk_size=None): # cutoff is list index of highest point to keep
     '''Replaces spectra in a set with their Fourier Tranforms (Hermitian and real-valued)'''
     if '(FT)' not in str(source_path):
         raise TypeError('Input must first be Fourierized')   
-    base_transform(source_path, operator=inv_fourier, indicator='(IFT)') # transform is converted to list (np arrays are not JSON serializable)  
+    return base_transform(source_path, batch_operator=batch_inv_fourier, indicator='(IFT)', chunk_size=chunk_size)
     
-def fourier_filterize(source_path, cutoff):  # combines functionality of fourierize (with cutoff) and the inverse transform
+def fourier_filterize(source_path, cutoff, chunk_size=None):  # combines functionality of fourierize (with cutoff) and the inverse transform
     '''Reduces high-frequency noise in a dataset'''
-    base_transform(source_path, operator=lambda spectrum : inv_fourier(fourier(spectrum, cutoff=cutoff)), indicator=f'(SFT{cutoff})')
+    return base_transform(source_path, batch_operator=lambda spectra : batch_inv_fourier(batch_fourier(spectra, cutoff=cutoff)), indicator=f'(SFT{cutoff})', chunk_size=chunk_size)
+    
+    
+# peak detection and drift alignment
+def parabolic_offsets(spectra, indices):
+    '''Sub-point refinement of peak positions: fits a parabola through each peak and its two neighbours, returning the offset of each vertex 
+    from the peak's index (within +/- 0.5). Peaks at either end of a spectrum are left unrefined'''
+    inner = np.clip(indices, 1, spectra.shape[1] - 2)
+    left, centre, right = (np.take_along_axis(spectra, inner + offset, axis=1) for offset in (-1, 0, 1))
+    curvature = left - 2*centre + right
+    offsets = np.divide(left - right, 2*curvature, out=np.zeros_like(curvature, dtype=float), where=(curvature < 0))
+    return np.where(inner == indices, np.clip(offsets, -0.5, 0.5), 0)
+
+def rip_positions(spectra, refine=True):
+    '''Batched analogue of get_RIP() which locates, rather than measures, the RIP: returns the drift index of the maximum of the first half of every 
+    spectrum (row) at once, refined to a fractional index by parabolic interpolation unless "refine" is False'''
+    spectra = np.asarray(spectra, dtype=float)
+    indices = spectra[:, :spectra.shape[1]//2].argmax(axis=1)[:, None]
+    return (indices + parabolic_offsets(spectra, indices) if refine else indices).ravel()
+
+def find_peaks(spectra, n_peaks=3, min_separation=3, min_height=None):
+    '''Finds the "n_peaks" highest peaks of every spectrum (row) in one pass. A peak is a point which is the maximum of the window of "min_separation"
+    points either side of it (which also suppresses lesser maxima on the shoulders of larger peaks) and, if given, is at least "min_height". Returns 
+    arrays of (fractional, parabolically refined) peak positions and of peak heights, each of shape (n_spectra, n_peaks), ordered by descending height;
+    rows with fewer peaks than requested are padded with NaN'''
+    spectra = np.asarray(spectra, dtype=float)
+    padded = np.pad(spectra, ((0, 0), (min_separation, min_separation)), constant_values=-np.inf)
+    window_max = np.lib.stride_tricks.sliding_window_view(padded, 2*min_separation + 1, axis=1).max(axis=2)
+    is_peak = (spectra == window_max) & (min_height is None or spectra >= min_height)
+    
+    heights = np.where(is_peak, spectra, -np.inf)
+    n_peaks = min(n_peaks, spectra.shape[1])
+    indices = np.argsort(-heights, axis=1, kind='stable')[:, :n_peaks]
+    peak_heights = np.take_along_axis(heights, indices, axis=1)
+    found = np.isfinite(peak_heights)
+    positions = indices + parabolic_offsets(spectra, indices)
+    return np.where(found, positions, np.nan), np.where(found, peak_heights, np.nan)
+
+def resample_rows(spectra, coordinates):
+    '''Linearly interpolates every spectrum (row) at its own row of (fractional) drift coordinates in one vectorized operation; 
+    coordinates outside the spectrum take the nearest edge value'''
+    coordinates = np.clip(coordinates, 0, spectra.shape[1] - 1)
+    lower = np.minimum(np.floor(coordinates).astype(int), spectra.shape[1] - 2)
+    weights = coordinates - lower
+    return (1 - weights)*np.take_along_axis(spectra, lower, axis=1) + weights*np.take_along_axis(spectra, lower + 1, axis=1)
+
+def align_spectra(spectra, reference, mode='shift'):
+    '''Aligns the RIP of every spectrum to the reference drift position at once. In "shift" mode each spectrum is translated along the drift axis,
+    in "stretch" mode the drift axis is rescaled about its origin (as drift times scale with e.g. temperature and pressure)'''
+    spectra = np.asarray(spectra, dtype=float)
+    positions = rip_positions(spectra)[:, None]
+    drift_axis = np.arange(spectra.shape[1], dtype=float)[None, :]
+    if mode == 'shift':
+        coordinates = drift_axis + (positions - reference)
+    elif mode == 'stretch':
+        coordinates = drift_axis*np.divide(positions, reference, out=np.ones_like(positions), where=(reference != 0))
+    else:
+        raise ValueError(f'Unknown alignment mode "{mode}"; use "shift" or "stretch"')
+    return resample_rows(spectra, coordinates)
+
+def alignize(source_path, mode='shift', reference=None, chunk_size=None):
+    '''Corrects drift-time offsets between acquisitions by aligning every spectrum's RIP to a common reference position (see align_spectra()), 
+    which sharpens species averages. By default the reference is the median RIP position of the dataset; the reference used is stored in the output
+    under "alignment_reference", so that test or new data can be aligned identically by passing it back in. Returns the path to the output'''
+    if reference is None:
+        if chunk_size:
+            reference = float(np.median(streamed_reduced(source_path, 'RIP_position', chunk_size)[2]))
+        else:
+            reference = float(np.median(reduced(load_chem_json(source_path)['chem_data'], 'RIP_position')))
+    indicator = f'(A{mode == "stretch" and "S" or ""})'
+    return base_transform(source_path, batch_operator=align_spectra, reference=reference, mode=mode, indicator=indicator, chunk_size=chunk_size, 
+                          metadata={'alignment_reference' : reference})
+
+
+# resampling, to shrink input width (and so learn/test file size and training time)
+def bin_spectra(spectra, factor, method='mean'):
+    '''Downsamples every spectrum (row) at once by pooling each run of "factor" consecutive points into one, by their mean or their max. 
+    If the spectrum size isn't a multiple of the factor, the last bin pools the remaining points'''
+    starts = np.arange(0, spectra.shape[1], factor)
+    if method == 'mean':
+        return np.add.reduceat(spectra, starts, axis=1)/np.diff(np.append(starts, spectra.shape[1]))
+    elif method == 'max':
+        return np.maximum.reduceat(spectra, starts, axis=1)
+    raise ValueError(f'Unknown binning method "{method}"; use "mean" or "max"')
+
+def interpolate_spectra(spectra, size):
+    '''Resamples every spectrum (row) at once onto "size" evenly spaced points spanning the original drift axis, by linear interpolation'''
+    coordinates = np.broadcast_to(np.linspace(0, spectra.shape[1] - 1, size), (len(spectra), size))
+    return resample_rows(np.asarray(spectra, dtype=float), coordinates)
+
+def resamplize(source_path, factor=None, method='mean', size=None, chunk_size=None):
+    '''Shrinks the width of every spectrum, either by integer binning by "factor" (pooling by "mean" or "max", see bin_spectra()) or, if a target
+    "size" is given instead, by interpolation onto that many points (see interpolate_spectra()). Unlike truncatize(), the whole drift range is kept'''
+    if bool(factor) == bool(size):
+        raise ValueError('Exactly one of a binning factor or a target size must be given')
+    elif size:
+        return base_transform(source_path, batch_operator=interpolate_spectra, size=size, indicator=f'(RSI{size})', chunk_size=chunk_size)
+    return base_transform(source_path, batch_operator=bin_spectra, factor=factor, method=method, indicator=f'(RS{factor}{method == "max" and "M" or ""})', chunk_size=chunk_size)
+
+
+# dimensionality reduction
+def fit_pca(source_path, n_components=None, variance=0.99, chunk_size=1000):
+    '''Fits principal components to the spectra of a dataset incrementally, streaming "chunk_size" spectra at a time, so only one chunk and the 
+    (spectrum_size x spectrum_size) scatter matrix are ever held. Chunks' means and centered scatters are merged pairwise (Chan et al.), which avoids 
+    the cancellation of the one-pass "sum of squares" formula. Keeps "n_components" components if given, otherwise the fewest which explain at least
+    the "variance" fraction of the total variance. Returns the basis as a dict of (json-serializable) lists'''
+    count, mean, scatter = 0, 0.0, 0.0
+    for chunk in iter_chem_chunks(source_path, chunk_size):
+        spectra = np.array([instance.spectrum for instance in chunk], dtype=float)
+        chunk_mean = spectra.mean(axis=0)
+        centered = spectra - chunk_mean
+        delta, new_count = chunk_mean - mean, count + len(spectra)
+        scatter = scatter + centered.T @ centered + np.outer(delta, delta)*(count*len(spectra)/new_count)
+        mean, count = mean + delta*(len(spectra)/new_count), new_count
+    
+    eigenvalues, eigenvectors = np.linalg.eigh(scatter/max(count - 1, 1))
+    eigenvalues, eigenvectors = np.maximum(eigenvalues[::-1], 0), eigenvectors[:, ::-1].T # descending order, one component per row
+    eigenvectors *= np.sign(eigenvectors[np.arange(len(eigenvectors)), np.abs(eigenvectors).argmax(axis=1)])[:, None] # fix signs, so refits give identical projections
+    variance_ratio = eigenvalues/eigenvalues.sum()
+    if not n_components:
+        n_components = int(np.searchsorted(np.cumsum(variance_ratio), variance - 1e-12) + 1)
     
+    return {'mean' : mean.tolist(), 'components' : eigenvectors[:n_components].tolist(), 'explained_variance' : eigenvalues[:n_components].tolist(),
+            'explained_variance_ratio' : variance_ratio[:n_components].tolist()}
+
+def pca_project(spectra, basis):
+    '''Projects a 2D array of spectra onto a fitted PCA basis (see fit_pca()), returning one row of component scores per spectrum'''
+    return (np.asarray(spectra) - np.asarray(basis['mean']))@np.asarray(basis['components']).T
+
+def pcaize(source_path, n_components=None, variance=0.99, basis_path=None, chunk_size=None):
+    '''Replaces spectra with their scores on the leading principal components, giving much narrower learn/test files for training. If a basis file is given 
+    (as written by a previous pcaize()), the data are projected onto that basis, so that test or new data are reduced identically to the data it was fitted on; 
+    otherwise a basis is fitted (see fit_pca()) and written alongside the output as "<name>(PCA<n>) Basis.basis" (json content, but not a .json, so that it is 
+    never listed as a dataset). The basis is also stored in the output under "pca_basis". Returns the path of the output'''
+    if basis_path:
+        with open_data(basis_path) as basis_file:
+            basis = json.load(basis_file)
+    else:
+        basis = fit_pca(source_path, n_components=n_components, variance=variance, chunk_size=chunk_size or 1000)
     
+    indicator = f'(PCA{len(basis["components"])})'
+    dest_path = base_transform(source_path, batch_operator=pca_project, basis=basis, indicator=indicator, chunk_size=chunk_size, metadata={'pca_basis' : basis})
+    if not basis_path:
+        with open_data(derived_path(source_path, f'{indicator} Basis', ext='.basis'), mode='w') as basis_file:
+            json.dump(basis, basis_file)
+    return dest_path
+
+    
+
 # analysis and data characterization methods---------------------------------------------------------------------------------------------------------------------------
 def inspect_spectra(source_path, species, ncols=6, save_path=None, marker='c-'):
     '''Plot the spectra of all instances of one species in the chosen dataset'''
-    json_data = load_chem_json(source_path)
+    json_data = load_chem_subset(source_path, species=(species,)) # only the spectra of the chosen species are read
     if species not in json_data['species']:
         raise ValueError(f'Species "{species}" not in dataset')
 
@@ -203,17 +694,18 @@ def inspect_spectra(source_path, species, ncols=6, save_path=None, marker='c-'):
 def inspect_variation(source_path, ncols=6, save_path=None):
     '''Generate a set of plots for all species in a dataset which shows how the baseline noise varies across spectra at each sample point'''
     json_data = load_chem_json(source_path)
-    plots = [PWA_Plot([instance.spectrum
-                           for instance in json_data['chem_data']
-                               if instance.species == species], species) 
-             for species in json_data['species']]  
+    species_stats = json_data.get('species_stats') # datasets written before summary statistics were stored must have them computed here
+    if not species_stats:
+        species_stats = grouped_summary_stats([instance.species for instance in json_data['chem_data']], [instance.spectrum for instance in json_data['chem_data']], quantiles=())
+        
+    plots = [PWA_Plot(None, species, stats=species_stats[species]) for species in json_data['species']]  
     
     panel = Multiplot(ncols=ncols, span=len(plots))
     panel.draw_series(plots)
     
     if save_path:
         source_path = sanitized_path(source_path) # ensure Pathlike object pointing to json
-        named_save_path = Path(save_path, f'{sanitized_path(source_path).stem} Species-wise PWAs')
+        named_save_path = Path(save_path, f'{data_stem(source_path)} Species-wise PWAs')
         panel.save(named_save_path)     
     
 def inspect_fsmoothing(source_path, inst, initial_cutoff=0, nsteps=1, step_size=1, ncols=6, save_figure=False):
@@ -237,7 +729,7 @@ def inspect_fsmoothing(source_path, inst, initial_cutoff=0, nsteps=1, step_size=
     
     plots = [Single_Line_Plot(orig_data, title='Original Spectrum')]
     for cutoff in range(initial_cutoff, max_cutoff, step_size):
-        cut_fft_data = np.fft.hfft(orig_data)
+        cut_fft_data = fft_data.copy() # the transform is only computed once, each cutoff masks a fresh copy
         cut_fft_data[cutoff:] = 0 
         plots.append(Single_Line_Plot(np.fft.ihfft(cut_fft_data).real, title=f'Reconstructed Spectrum  (to freq. {cutoff})'))
 
@@ -254,6 +746,68 @@ def inspect_fsmoothing(source_path, inst, initial_cutoff=0, nsteps=1, step_size=
         save_path = f'{cutoff and "Singular" or "Ranged"} Fourier Smoothing of {inst}'
         panel.save(save_path)
 
+def fourier_cutoff_sweep(source_path, cutoffs=None, by_species=False, block_size=64, plot=False, save_path=None):
+    '''Evaluates how well each Fourier smoothing cutoff (as used by fourier_filterize) reconstructs the spectra of a dataset, to guide the choice of cutoff.
+    Each instance is transformed only once; as the inverse transform is linear, the reconstructions at every cutoff are obtained together as cumulative
+    sums of the contributions of each frequency. Returns a table (dict of columns) of the RMSE of reconstruction and the peak height retention (ratio of 
+    reconstructed to original maxima), averaged over all instances or, if "by_species" is set, over each species. Optionally plots the overall curves'''
+    if 'FT' in str(source_path):
+        raise TypeError('Method only applies to non-Fourier Transformed data') 
+    
+    json_data = load_chem_json(source_path)
+    spectra = np.array([instance.spectrum for instance in json_data['chem_data']], dtype=float)
+    fft_spectra = batch_fourier(spectra)
+    fft_size = fft_spectra.shape[-1]
+    
+    cutoffs = np.arange(1, fft_size + 1) if cutoffs is None else np.asarray(list(cutoffs))
+    if cutoffs.min() < 1 or cutoffs.max() > fft_size:
+        raise ValueError(f'Cutoffs must lie between 1 and the FFT data size ({fft_size})')
+    
+    basis = batch_inv_fourier(np.eye(fft_size)) # reconstruction contributed by each individual frequency at unit amplitude
+    rmse, retention = np.empty((spectra.shape[0], cutoffs.size)), np.empty((spectra.shape[0], cutoffs.size))
+    for start in range(0, spectra.shape[0], block_size): # blocks of instances bound the memory needed for the (instance x frequency x point) contributions
+        block, fft_block = spectra[start:start+block_size], fft_spectra[start:start+block_size]
+        reconstructions = np.cumsum(fft_block[:, :, None]*basis[None, :, :], axis=1)[:, cutoffs - 1, :] # cumulative mask: cutoff c keeps frequencies below c
+        rmse[start:start+block_size] = np.sqrt(np.mean((reconstructions - block[:, None, :])**2, axis=-1))
+        peaks = block.max(axis=-1)[:, None]
+        retention[start:start+block_size] = np.divide(reconstructions.max(axis=-1), peaks, out=np.full(reconstructions.shape[:2], np.nan), where=(peaks > 0)) # retention is undefined for spectra with no positive peak
+    
+    table = {'cutoff' : cutoffs.tolist(), 'rmse' : rmse.mean(axis=0).tolist(), 'peak_retention' : np.nanmean(retention, axis=0).tolist()}
+    if by_species:
+        species = np.array([instance.species for instance in json_data['chem_data']])
+        table = {'species' : [], 'cutoff' : [], 'rmse' : [], 'peak_retention' : []}
+        for spec in json_data['species']:
+            members = (species == spec)
+            table['species'].extend([spec]*cutoffs.size)
+            table['cutoff'].extend(cutoffs.tolist())
+            table['rmse'].extend(rmse[members].mean(axis=0).tolist())
+            table['peak_retention'].extend(np.nanmean(retention[members], axis=0).tolist())
+    
+    if plot:
+        panel = Multiplot(nrows=1, ncols=2) # plotted against the cutoffs themselves, which need not be evenly spaced
+        panel.draw(Line_Plot(rmse.mean(axis=0), x_data=cutoffs.tolist(), title='Reconstruction RMSE by Cutoff', colormap={'RMSE' : 'r'}), 0)
+        panel.draw(Line_Plot(np.nanmean(retention, axis=0), x_data=cutoffs.tolist(), title='Peak Height Retention by Cutoff', colormap={'Retention' : 'b'}), 1)
+        if save_path:
+            source_path = sanitized_path(source_path) # ensure Pathlike object pointing to json
+            panel.save(Path(save_path, f'{data_stem(source_path)} Fourier Cutoff Sweep'))
+    
+    return table
+
+def precision_report(source_path, dtype='float32'):
+    '''Quantifies the error incurred and memory saved by holding a dataset at reduced precision (float32 by default) rather than float64.
+    Returns a dict of the maximum and RMS absolute errors, the maximum error relative to each spectrum's peak, and the array sizes in bytes'''
+    full = np.array([instance.spectrum for instance in load_chem_json(source_path, dtype='float64')['chem_data']])
+    reduced = full.astype(dtype)
+    error = np.abs(reduced.astype('float64') - full)
+    peaks = np.abs(full).max(axis=1, keepdims=True)
+    
+    return {'dtype' : np.dtype(dtype).name,
+            'max_abs_error' : float(error.max()),
+            'rms_error' : float(np.sqrt(np.mean(error**2))),
+            'max_rel_error' : float(np.max(np.divide(error, peaks, out=np.zeros_like(error), where=(peaks != 0)))),
+            'float64_bytes' : full.nbytes,
+            'reduced_bytes' : reduced.nbytes}
+
 def inspect_fourier_maxima(source_path, save_path=None):
     '''Plot all Fourier maxima (e.g. the baseline magnitudes) by family, in the order the families appear in the data'''
     if '(FT)' not in str(source_path):
@@ -271,5 +825,96 @@ def inspect_fourier_maxima(source_path, save_path=None):
     
     if save_path:
         source_path = sanitized_path(source_path) # ensure Pathlike object pointing to json
-        save_path = save_path/f'Fourier Maxima by Family - {source_path.stem}'
-        panel.save(save_path)
\ No newline at end of file
+        save_path = save_path/f'Fourier Maxima by Family - {data_stem(source_path)}'
+        panel.save(save_path)
+
+# similarity search
+Neighbour = collections.namedtuple('Neighbour', ['name', 'species', 'distance'])
+
+class SpectralIndex:
+    '''Nearest-neighbour index over the spectra of a dataset, for asking which known instances (and so species) a spectrum most resembles, or 
+    which instances are near-identical. Supports Euclidean, cosine (1 - cosine similarity) and correlation (1 - Pearson correlation) distances.
+    Spectra are prepared once so that all three reduce to Euclidean distance: cosine over unit-normalized spectra, correlation over centered and 
+    unit-normalized spectra (for which |u - v|^2 = 2(1 - u.v)). Queries are answered by a KD-tree if scipy is available (and "use_tree" is not 
+    False), otherwise by brute force in blocks of "block_size" queries, each block being a single matrix product against all indexed spectra'''
+    metrics = ('euclidean', 'cosine', 'correlation')
+    
+    def __init__(self, chem_data, metric='euclidean', use_tree=None, block_size=256):
+        if metric not in self.metrics:
+            raise ValueError(f'Unknown metric "{metric}"; use one of {", ".join(self.metrics)}')
+        self.metric, self.block_size = metric, block_size
+        self.names = [instance.name for instance in chem_data]
+        self.species = [instance.species for instance in chem_data]
+        self.points = self.prepare(np.array([instance.spectrum for instance in chem_data], dtype=float))
+        self.sq_norms = (self.points**2).sum(axis=1)
+        
+        self.tree = None
+        if use_tree is not False:
+            try:
+                from scipy.spatial import cKDTree # optional dependency, only used to speed up queries
+                self.tree = cKDTree(self.points)
+            except ImportError:
+                if use_tree:
+                    raise
+    
+    @classmethod
+    def from_file(cls, source_path, **kwargs):
+        '''Builds an index over all instances of a dataset file'''
+        return cls(load_chem_json(source_path)['chem_data'], **kwargs)
+    
+    def __len__(self):
+        return len(self.names)
+        
+    def prepare(self, spectra):
+        '''Maps spectra (rows of a 2D array) into the space in which the chosen metric is Euclidean'''
+        if self.metric == 'correlation':
+            spectra = spectra - spectra.mean(axis=1, keepdims=True)
+        if self.metric in ('cosine', 'correlation'):
+            norms = np.linalg.norm(spectra, axis=1, keepdims=True)
+            spectra = np.divide(spectra, norms, out=np.zeros_like(spectra), where=(norms != 0))
+        return spectra
+    
+    def search(self, points, k):
+        '''Returns the (k smallest) squared Euclidean distances and indices of prepared query points to the indexed points, sorted by distance'''
+        if self.tree is not None:
+            distances, indices = self.tree.query(points, k=k)
+            return distances.reshape(len(points), k)**2, indices.reshape(len(points), k)
+        
+        sq_distances, indices = [], []
+        for start in range(0, len(points), self.block_size):
+            block = points[start:start + self.block_size]
+            block_sq = np.maximum((block**2).sum(axis=1)[:, None] + self.sq_norms[None, :] - 2*block@self.points.T, 0) # clip rounding below 0
+            nearest = np.argpartition(block_sq, k - 1, axis=1)[:, :k] if k < len(self) else np.tile(np.arange(len(self)), (len(block), 1))
+            nearest_sq = np.take_along_axis(block_sq, nearest, axis=1)
+            order = np.argsort(nearest_sq, axis=1, kind='stable')
+            sq_distances.append(np.take_along_axis(nearest_sq, order, axis=1))
+            indices.append(np.take_along_axis(nearest, order, axis=1))
+        return np.concatenate(sq_distances), np.concatenate(indices)
+    
+    def query(self, spectra, k=5, exclude=()):
+        '''Finds the k nearest indexed instances to a spectrum, or to each of a batch of spectra (2D), returning lists of Neighbours ordered from 
+        nearest to farthest (one list per spectrum for batches). Instances named in "exclude" are skipped (e.g. the query instance itself)'''
+        spectra = np.asarray(spectra, dtype=float)
+        single = (spectra.ndim == 1)
+        spectra = np.atleast_2d(spectra)
+        k_search = min(k + len(exclude), len(self))
+        
+        sq_distances, indices = self.search(self.prepare(spectra), k_search)
+        distances = np.sqrt(sq_distances) if self.metric == 'euclidean' else sq_distances/2 # see class docstring for the cosine/correlation identity
+        results = [[Neighbour(self.names[i], self.species[i], dist) for i, dist in zip(row_indices.tolist(), row_distances.tolist()) 
+                        if self.names[i] not in exclude][:k]
+                            for row_indices, row_distances in zip(indices, distances)]
+        return results[0] if single else results
+    
+    def query_instances(self, chem_data, k=5):
+        '''Finds the k nearest neighbours of each of a list of Instances, excluding any indexed instance of the same name as the one queried. 
+        Returns a dict of neighbour lists by instance name'''
+        neighbour_lists = self.query([instance.spectrum for instance in chem_data], k=k+1)
+        return {instance.name : [neighbour for neighbour in neighbours if neighbour.name != instance.name][:k] 
+                    for instance, neighbours in zip(chem_data, neighbour_lists)}
+    
+    def classify(self, spectrum, k=5):
+        '''Returns the species most common among the k nearest neighbours of a spectrum (ties going to the nearer species), along with the neighbours'''
+        neighbours = self.query(spectrum, k=k)
+        votes = collections.Counter(neighbour.species for neighbour in neighbours)
+        return max(votes, key=lambda species : (votes[species], -min(n.distance for n in neighbours if n.species == species))), neighbours
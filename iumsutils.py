@@ -1,5 +1,6 @@
-import csv, json, random, re, collections
+import csv, json, logging, random, re, collections, importlib, shutil, weakref, threading
 from pathlib import Path
+from profutils import instrumented, stage
  
 # utilities specifically written to avoid having to import entire modules for a single object's functionality
 def average(iterable, precision=4): 
@@ -20,6 +21,34 @@ def format_time(sec):
 def ceildiv(a, b):
     '''Ceiling analogue of floor division operator, meant to avoid importing math'''
     return -(a // -b)
+
+class LazyModule:
+    '''Stand-in for a module which defers the actual (potentially slow) import until one of the module's attributes is first accessed'''
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+        
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+            self.__dict__.update(self._module.__dict__) # copy module contents in, so subsequent lookups are ordinary attribute lookups (bypass __getattr__)
+        return self._module
+        
+    def __getattr__(self, attr): # only invoked for attributes which haven't been found, i.e. before the module is loaded
+        return getattr(self._load(), attr)
+    
+    def __dir__(self):
+        return dir(self._load())
+    
+    def __repr__(self):
+        return f'<lazy module "{self._module_name}" ({self._module is None and "not yet loaded" or "loaded"})>'
+    
+def lazy_import(module_name):
+    '''Returns a placeholder for the named module which is only actually imported on first use'''
+    return LazyModule(module_name)
+
+np = lazy_import('numpy') # only needed for whole-dataset array operations
+shared_memory = lazy_import('multiprocessing.shared_memory') # only needed when datasets are handed off to worker processes
         
     
 # some general-purpose utilities
@@ -70,6 +99,76 @@ def get_RIP(mode1_spectrum):
     '''Naive but surprisingly effective method for identifying the RIP value for Mode 1 spectra'''
     return max(mode1_spectrum[:len(mode1_spectrum)//2]) # takes the RIP to be the maximum value in the first half of the spectrum
 
+
+# point-wise summary statistics, computed once when a dataset is created or transformed and stored alongside it
+stat_quantiles = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+def stat_values(values, dtype=None):
+    '''Converts an array of computed statistics for storage: to a list by default, or (for reduced-precision datasets) to an array of the dataset's
+    dtype, which serialized() then writes at that precision, so that stored statistics don't outweigh the spectra they were reduced from'''
+    if dtype and np.dtype(dtype) != np.float64:
+        return values.astype(dtype)
+    return values.tolist()
+
+def summary_stats(spectra, quantiles=stat_quantiles, dtype=None):
+    '''Takes a collection of equal-length spectra and returns a dict of the maxima, minima, means, standard deviations and 
+    chosen quantiles (under "quantiles", keyed by quantile) at each sample point, as json-serializable lists (see stat_values() for "dtype").
+    Statistics are always computed at double precision'''
+    spectra = np.asarray(spectra, dtype=float)
+    stats = {'max'  : stat_values(spectra.max(axis=0), dtype),
+             'min'  : stat_values(spectra.min(axis=0), dtype),
+             'mean' : stat_values(spectra.mean(axis=0), dtype),
+             'std'  : stat_values(spectra.std(axis=0), dtype)}
+    if quantiles:
+        stats['quantiles'] = {str(q) : stat_values(row, dtype) for q, row in zip(quantiles, np.quantile(spectra, quantiles, axis=0))}
+    return stats
+
+def grouped_summary_stats(labels, spectra, quantiles=stat_quantiles, dtype=None):
+    '''Takes parallel sequences of group labels (e.g. species or families) and spectra and returns a dict of summary_stats() by label.
+    Spectra are cast to a single array and sorted by label once, rather than re-gathered for each group'''
+    labels, spectra = np.asarray(labels), np.asarray(spectra, dtype=float)
+    order = np.argsort(labels, kind='stable')
+    group_names, starts = np.unique(labels[order], return_index=True)
+    return {str(name) : summary_stats(group, quantiles=quantiles, dtype=dtype) for name, group in zip(group_names, np.split(spectra[order], starts[1:]))}
+
+class RunningStats:
+    '''Accumulates the point-wise statistics of summary_stats() over successive batches of spectra, for datasets which are never held in memory whole.
+    Quantiles cannot be computed in a single streaming pass, and so are omitted'''
+    def __init__(self):
+        self.n = 0
+        self.total = self.total_sq = self.maxima = self.minima = None
+        
+    def update(self, spectra):
+        spectra = np.asarray(spectra, dtype='float64')
+        if not self.n:
+            self.total, self.total_sq = np.zeros(spectra.shape[1]), np.zeros(spectra.shape[1])
+            self.maxima, self.minima = np.full(spectra.shape[1], -np.inf), np.full(spectra.shape[1], np.inf)
+        self.n += spectra.shape[0]
+        self.total += spectra.sum(axis=0)
+        self.total_sq += (spectra**2).sum(axis=0)
+        np.maximum(self.maxima, spectra.max(axis=0), out=self.maxima)
+        np.minimum(self.minima, spectra.min(axis=0), out=self.minima)
+        
+    def stats(self, dtype=None):
+        mean = self.total/self.n
+        return {'max'  : stat_values(self.maxima, dtype),
+                'min'  : stat_values(self.minima, dtype),
+                'mean' : stat_values(mean, dtype),
+                'std'  : stat_values(np.sqrt(np.maximum(self.total_sq/self.n - mean**2, 0)), dtype)} # clipped, as rounding can make the variance slightly negative
+
+def update_grouped_stats(running_stats, labels, spectra):
+    '''Takes a dict of RunningStats by label and a batch of labelled spectra, and updates (or creates) the RunningStats of each label present'''
+    labels, spectra = np.asarray(labels), np.asarray(spectra)
+    for label in np.unique(labels):
+        running_stats.setdefault(str(label), RunningStats()).update(spectra[labels == label])
+
+def dataset_stats(chem_data, dtype=None):
+    '''Takes a list of Instances (or of equivalent tuples) and returns the species-wise and family-wise summary statistics.
+    Unless a dtype is given, statistics are stored at the precision of the spectra themselves (see stat_values())'''
+    names, species, families, spectra, vectors = zip(*chem_data)
+    dtype = dtype or getattr(spectra[0], 'dtype', None) # spectra held as arrays (i.e. of datasets with a recorded dtype) carry their precision
+    return grouped_summary_stats(species, spectra, dtype=dtype), grouped_summary_stats(families, spectra, dtype=dtype)
+
             
 # utilities for handling instance naming and information packaging
 def sort_instance_names(name_list, data_key=lambda x:x):
@@ -118,31 +217,436 @@ def get_carbon_ordering(species):
     else:
         return 100 # arbitrary, needs to return a number much greater than the rest to be placed at end
 
+def serialized(obj):
+    '''Fallback for json.dump (pass as "default") which converts numpy arrays and scalars into their json-serializable Python equivalents.
+    Single-precision values are written with the shortest representation which round-trips at single precision, so reduced-precision files are smaller too'''
+    if getattr(obj, 'dtype', None) == 'float32':
+        if obj.ndim == 0:
+            return float(str(obj))
+        elif obj.ndim == 1:
+            return [float(str(value)) for value in obj] # str() of a float32 gives its shortest round-trip representation, float() of that is exact
+        return [serialized(row) for row in obj]
+    elif hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
 Instance = collections.namedtuple('Instance', ['name', 'species', 'family', 'spectrum', 'vector']) # provide class-like encoding of instances
 
+
+class InstanceView:
+    '''Lightweight stand-in for an Instance which refers to one row of a CompactChemData, rather than holding its own copies of the data.
+    Supports the same attribute access, unpacking, indexing and _replace() as an Instance (the last of which returns an ordinary Instance)'''
+    __slots__ = ('data', 'index')
+    
+    def __init__(self, data, index):
+        self.data, self.index = data, index
         
+    name     = property(lambda self : self.data.names[self.index])
+    species  = property(lambda self : self.data.species_table[self.data.species_codes[self.index]])
+    family   = property(lambda self : self.data.family_table[self.data.family_codes[self.index]])
+    spectrum = property(lambda self : self.data.spectra[self.index])
+    vector   = property(lambda self : self.data.family_vectors[self.data.family_codes[self.index]])
+    
+    def __iter__(self):
+        return iter((self.name, self.species, self.family, self.spectrum, self.vector))
+    
+    def __len__(self):
+        return len(Instance._fields)
+    
+    def __getitem__(self, i):
+        return tuple(self)[i]
+    
+    def _replace(self, **fields):
+        return Instance(*self)._replace(**fields)
+    
+    def tolist(self): # allows views to be json-serialized through serialized()
+        return list(self)
+    
+    def __repr__(self):
+        return f'InstanceView(name={self.name!r}, species={self.species!r}, family={self.family!r})'
+    
+class CompactChemData:
+    '''Array-backed replacement for a list of Instances. All spectra are held in one contiguous array, species and families as integer codes
+    into tables of their (single) names, and the one-hot vectors once per family. Indexing and iteration give InstanceViews, so existing code
+    which reads chem_data by attribute continues to work, while resident memory is several times smaller than that of the equivalent Instances'''
+    def __init__(self, names, species, families, spectra, vectors, dtype=None):
+        self.names = list(names)
+        self.species_table, species_codes = self.encode(species)
+        self.family_table, family_codes = self.encode(families)
+        self.species_codes = np.array(species_codes, dtype='int32')
+        self.family_codes  = np.array(family_codes, dtype='int32')
+        self.spectra = np.array(spectra, dtype=dtype or 'float64')
+        self.family_vectors = {}
+        for code, vector in zip(self.family_codes.tolist(), vectors):
+            self.family_vectors.setdefault(code, tuple(vector)) # vectors are one-hot by family, so only one need be kept per family
+    
+    @staticmethod
+    def encode(labels):
+        '''Takes a sequence of labels and returns a list of the distinct labels (in order of appearance) and the code (table index) of each label'''
+        table = {}
+        codes = [table.setdefault(label, len(table)) for label in labels]
+        return list(table), codes
+    
+    @classmethod
+    def from_instances(cls, instances, dtype=None):
+        '''Packs any sequence of Instances (or of equivalent tuples) into a CompactChemData'''
+        instances = list(instances)
+        if not instances:
+            return cls([], [], [], np.empty((0, 0)), [], dtype=dtype)
+        return cls(*zip(*instances), dtype=dtype)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __getitem__(self, index):
+        if type(index) == slice:
+            return [InstanceView(self, i) for i in range(len(self))[index]]
+        return InstanceView(self, range(len(self))[index]) # indexing through a range handles negative indices and bounds-checking
+    
+    def __iter__(self):
+        return (InstanceView(self, i) for i in range(len(self)))
+    
+    def clear(self):
+        '''Empty the container (mirrors list.clear(), so the GUI can reset it in place)'''
+        self.__init__([], [], [], np.empty((0, 0)), [])
+        
+    def to_instances(self):
+        return [Instance(*view) for view in self]
+        
+    def tolist(self): # allows compact data to be json-serialized through serialized()
+        return [view.tolist() for view in self]
+
+SharedDatasetDescriptor = collections.namedtuple('SharedDatasetDescriptor', ['segment_names', 'shape', 'dtype', 'names', 'species_table', 'family_table', 'family_vectors'])
+SharedDatasetDescriptor.__doc__ = '''Small, picklable description of a published SharedDataset; passing this to a worker (rather than the data itself) is what makes the handoff zero-copy'''
+
+class SharedDataset:
+    '''Publishes the spectra and label codes of a dataset to shared memory once, so that worker processes can attach to them by name rather than
+    receiving a pickled copy of the whole of chem_data. Typical usage:
+    
+        with SharedDataset(chem_data) as shared:
+            with multiprocessing.Pool(initializer=worker_init, initargs=(shared.descriptor,)) as pool: ... # workers call SharedDataset.attach(descriptor)
+    
+    The publishing process owns the segments and unlinks them on exit from the with block, on close(), on garbage collection, or at interpreter
+    exit (whichever comes first), so segments are not leaked when a run fails partway through'''
+    columns = ('spectra', 'species_codes', 'family_codes')
+    
+    def __init__(self, chem_data, dtype=None):
+        if not isinstance(chem_data, CompactChemData):
+            chem_data = CompactChemData.from_instances(chem_data, dtype=dtype)
+        
+        self.segments = []
+        try:
+            for column in self.columns:
+                array = getattr(chem_data, column)
+                segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1)) # zero-size segments are not permitted
+                np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+                self.segments.append(segment)
+        except BaseException:
+            self.release(self.segments, unlink=True)
+            raise
+        self._finalizer = weakref.finalize(self, self.release, self.segments, True) # also runs at interpreter exit
+        
+        self.descriptor = SharedDatasetDescriptor(segment_names=tuple(segment.name for segment in self.segments), shape=chem_data.spectra.shape,
+                                                  dtype=chem_data.spectra.dtype.str, names=chem_data.names, species_table=chem_data.species_table,
+                                                  family_table=chem_data.family_table, family_vectors=chem_data.family_vectors)
+    
+    @staticmethod
+    def release(segments, unlink=False):
+        '''Close (and, for the owning process, unlink) a list of segments, tolerating any which are already gone'''
+        for segment in segments:
+            try:
+                segment.close()
+                if unlink:
+                    segment.unlink()
+            except (FileNotFoundError, BufferError):
+                pass
+        segments.clear()
+        
+    def close(self):
+        '''Release the shared segments; any attached workers should be finished with the data beforehand'''
+        self._finalizer()
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    @staticmethod
+    def attach(descriptor):
+        '''Called in a worker process to obtain a read-only CompactChemData whose arrays are views into the published shared memory.
+        The worker's handles to the segments are closed when the returned object is garbage collected'''
+        segments = []
+        for segment_name in descriptor.segment_names:
+            try:
+                segment = shared_memory.SharedMemory(name=segment_name, track=False) # Python 3.13+, stops the worker's resource tracker from unlinking the segment
+            except TypeError:
+                segment = shared_memory.SharedMemory(name=segment_name)
+            segments.append(segment)
+        
+        nrows = descriptor.shape[0]
+        arrays = [np.ndarray(descriptor.shape, dtype=descriptor.dtype, buffer=segments[0].buf)]
+        arrays.extend(np.ndarray((nrows,), dtype='int32', buffer=segment.buf) for segment in segments[1:])
+        for array in arrays:
+            array.flags.writeable = False
+        
+        data = CompactChemData.__new__(CompactChemData) # arrays are already built, so the constructor is bypassed
+        data.spectra, data.species_codes, data.family_codes = arrays
+        data.names, data.species_table, data.family_table, data.family_vectors = descriptor.names, descriptor.species_table, descriptor.family_table, descriptor.family_vectors
+        data._segments = segments # keeps the buffers alive for as long as the data is
+        weakref.finalize(data, SharedDataset.release, segments)
+        return data
+
 #file and path utilities
+compressors = { # compression suffixes which are handled transparently, and the (standard library) modules which handle them
+    '.gz'  : 'gzip',
+    '.xz'  : 'lzma',
+    '.bz2' : 'bz2'
+}
+
+def compression_suffix(path):
+    '''Returns the compression suffix of a path (e.g. ".gz"), or an empty string if the file is uncompressed'''
+    suffix = Path(path).suffix
+    return suffix if suffix in compressors else ''
+
+def data_suffix(path):
+    '''Returns the extension of a (possibly compressed) data file, disregarding any compression suffix (e.g. ".json" for "data.json.xz")'''
+    path = Path(path)
+    return Path(path.stem).suffix if compression_suffix(path) else path.suffix
+
+def data_stem(path):
+    '''Returns the name of a (possibly compressed) data file, stripped of both its extension and any compression suffix'''
+    path = Path(path)
+    return Path(path.stem).stem if compression_suffix(path) else path.stem
+
+def derived_path(source_path, indicator='', ext='.json'):
+    '''Path for a file derived from a data file, in the same folder and with the same compression, with an indicator appended to the name'''
+    source_path = Path(source_path)
+    return source_path.parent/f'{data_stem(source_path)}{indicator}{ext}{compression_suffix(source_path)}'
+
+def open_data(path, mode='r', **kwargs):
+    '''Opens a data file, transparently (de)compressing it according to its suffix. Text mode is the default, as with open(). Compressed 
+    files are streamed through the decompressor, so the full compressed and decompressed forms are never both held in memory'''
+    path = Path(path)
+    if compression_suffix(path):
+        if 'b' not in mode and 't' not in mode:
+            mode += 't' # compression modules default to binary mode, unlike open()
+        return importlib.import_module(compressors[path.suffix]).open(path, mode, **kwargs)
+    return path.open(mode, **kwargs)
+
+def resolve_data_path(path):
+    '''Takes the uncompressed path to a data file and returns the path to whichever of it or its compressed versions exists (uncompressed first)'''
+    path = Path(path)
+    for suffix in ('', *compressors):
+        candidate = path.parent/f'{path.name}{suffix}'
+        if candidate.exists():
+            return candidate
+    return path
+
+def compress_file(source_path, suffix='.gz', remove_source=False):
+    '''Streams a copy of a data file into a compressed version with the given suffix (or, if the file is already compressed, into an 
+    uncompressed version if no suffix is given), returning the new path. Data is copied in blocks, so the file is never held in memory whole'''
+    source_path = Path(source_path)
+    dest_path = source_path.parent/f'{data_stem(source_path)}{data_suffix(source_path)}{suffix}'
+    with open_data(source_path, mode='rb') as source_file, open_data(dest_path, mode='wb') as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    if remove_source:
+        source_path.unlink()
+    return dest_path
+
+def name_lineage(path):
+    '''Infers the transforms a dataset has undergone from the parenthesized indicators in its file name, in order'''
+    return re.findall(r'\(.*?\)', data_stem(path))
+
 def sanitized_path(path, ext='.json'):
-    '''Ensures that a specified path is a Pathlike object and has the proper file extension'''
+    '''Ensures that a specified path is a Pathlike object and has the proper file extension (compression suffixes such as ".gz" are permitted after it)'''
     if type(path) == str:
         path = Path(path) # ensure path is a Path object, allows for string input
     
-    if path.suffix != ext:
+    if data_suffix(path) != ext:
         raise TypeError(f'Input must be a(n) {ext} file')
     else:
         return path
 
-def load_chem_json(source_path):
-    '''Read a chemical data json, de-serializes the Instance objects from "chem_data", and return the contents of the file'''
+@instrumented('JSON parsing')
+def load_chem_json(source_path, dtype=None, compact=False):
+    '''Read a chemical data json, de-serializes the Instance objects from "chem_data", and return the contents of the file.
+    If a dtype is given (or the dataset records one under "dtype"), the spectra are held as rows of a single array of that dtype, rather than as lists of floats.
+    If "compact" is set, chem_data is instead returned as an array-backed CompactChemData, which is much smaller in memory'''
     source_path = sanitized_path(source_path)
-    with source_path.open(mode='r') as source_file:
+    with open_data(source_path, mode='r') as source_file:
         json_data = json.load(source_file) # this comment is a watermark - 2020, timotej bernat
-        json_data['chem_data'] = [Instance(*properties) for properties in json_data['chem_data']] # unpack the properties into Instance objects
+    
+    if compact:
+        json_data['chem_data'] = CompactChemData.from_instances(json_data['chem_data'], dtype=dtype or json_data.get('dtype'))
+    else:
+        json_data['chem_data'] = build_instances(json_data['chem_data'], json_data, dtype=dtype)
     return json_data
 
-def jsonize(source_path, correct_names=False): 
+def build_instances(chem_data, json_data, dtype=None):
+    '''Packages a list of (name, species, family, spectrum, vector) properties into Instances, casting the spectra to rows of a single array 
+    if a dtype is given or recorded in the dataset fields (in which case the dtype is recorded, so that it is carried through any transforms)'''
+    dtype = dtype or json_data.get('dtype')
+    if not dtype:
+        return [Instance(*properties) for properties in chem_data] # unpack the properties into Instance objects
+    
+    spectra = np.array([properties[3] for properties in chem_data], dtype=dtype) # one contiguous block, rows are views into it
+    json_data['dtype'] = np.dtype(dtype).name 
+    return [Instance(name, species, family, spectrum, vector) for (name, species, family, _, vector), spectrum in zip(chem_data, spectra)]
+
+class ChemJSONReader:
+    '''Incremental parser for chemical data jsons, which reads the file in blocks and yields instances one at a time. Spectra of instances which
+    are not selected are skipped over without being parsed. All other fields of the dataset are collected into "header" as they are encountered
+    (in files written by this package they follow "chem_data", so the header is only complete once all instances have been read)'''
+    whitespace = re.compile(r'\s*')
+    
+    def __init__(self, source_file, block_size=2**20):
+        self.source_file = source_file
+        self.block_size  = block_size
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.pos, self.eof = '', 0, False
+        self.header = {}
+        self.instance_count = None # set once the whole of "chem_data" has been read, so remains None for files which have none
+    
+    def fill(self, grow=False):
+        '''Read another block into the buffer, discarding everything which has already been parsed. If "grow" is set, at least as much as is 
+        currently buffered is read, so that values which span many blocks are re-attempted only a logarithmic number of times'''
+        block = self.source_file.read(max(self.block_size, grow and len(self.buffer) - self.pos))
+        self.eof = not block
+        self.buffer, self.pos = self.buffer[self.pos:] + block, 0
+        
+    def peek(self):
+        '''Returns the next non-whitespace character (without consuming it), or an empty string at the end of the file'''
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos+1]
+            self.fill()
+    
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Malformed chemical data json: expected "{char}" at "{self.buffer[self.pos:self.pos+20]}"')
+        self.pos += 1
+        
+    def skip_comma(self):
+        if self.peek() == ',':
+            self.pos += 1
+    
+    def value(self):
+        '''Parse and return the next complete json value'''
+        while True:
+            self.peek()
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof: # a value ending at the very end of the buffer (e.g. a number) may have been cut short
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(grow=True)
+            
+    def skip_array(self):
+        '''Skip past a flat (un-nested) json array, such as a spectrum, without parsing its contents'''
+        self.expect('[')
+        while True:
+            end = self.buffer.find(']', self.pos)
+            if end >= 0:
+                self.pos = end + 1
+                return
+            elif self.eof:
+                raise ValueError('Malformed chemical data json: unterminated array')
+            self.pos = len(self.buffer)
+            self.fill()
+    
+    def instances(self, selector=lambda index, name, species, family : True):
+        '''Generator of the (name, species, family, spectrum, vector) properties of each instance for which the selector (a function of the 
+        instance's position in chem_data, name, species, and family) is True. Fills in the header fields over the course of the read'''
+        self.expect('{')
+        while self.peek() != '}':
+            key = self.value()
+            self.expect(':')
+            if key != 'chem_data':
+                self.header[key] = self.value()
+            else:
+                self.expect('[')
+                index = 0
+                while self.peek() != ']':
+                    self.expect('[')
+                    name = self.value();    self.expect(',')
+                    species = self.value(); self.expect(',')
+                    family = self.value();  self.expect(',')
+                    if selector(index, name, species, family):
+                        spectrum = self.value(); self.expect(',')
+                        vector = self.value()
+                        yield (name, species, family, spectrum, vector)
+                    else:
+                        self.skip_array(); self.expect(',')
+                        self.skip_array()
+                    self.expect(']')
+                    self.skip_comma()
+                    index += 1
+                self.expect(']')
+                self.instance_count = index
+            self.skip_comma()
+        self.expect('}')
+
+def read_chem_header(source_path):
+    '''Returns all the fields of a chemical data json except "chem_data", without parsing any spectra'''
+    with open_data(sanitized_path(source_path), mode='r') as source_file:
+        reader = ChemJSONReader(source_file)
+        for _ in reader.instances(selector=lambda *args : False): # every instance is skipped over
+            pass
+    return reader.header
+
+def iter_chem_chunks(source_path, chunk_size=1000, dtype=None, header=None):
+    '''Generator of successive lists of at most "chunk_size" Instances from a chemical data json, so that datasets can be processed without
+    being held in memory whole. The dtype (if given, or if recorded in the passed header) is applied to each chunk. If a header dict is passed,
+    it is updated with the remaining fields of the dataset once all instances have been read'''
+    header = {} if header is None else header
+    with open_data(sanitized_path(source_path), mode='r') as source_file:
+        reader = ChemJSONReader(source_file)
+        chunk = []
+        for properties in reader.instances():
+            chunk.append(properties)
+            if len(chunk) == chunk_size:
+                yield build_instances(chunk, header, dtype=dtype)
+                chunk = []
+        if chunk:
+            yield build_instances(chunk, header, dtype=dtype)
+    header.update(reader.header)
+
+@instrumented('JSON parsing')
+def load_chem_subset(source_path, species=None, exclude_species=(), families=None, exclude_families=(), rows=None, dtype=None):
+    '''Reads only the instances of a chemical data json which match the filters given: the species and families to include (all, if None) or 
+    exclude, and a range of positions in chem_data (a range or (start, stop) pair). Returns the dataset with the same fields as load_chem_json(),
+    with the species and family listings, counts and statistics recomputed for the subset (the family mapping is kept, so vectors remain valid)'''
+    source_path = sanitized_path(source_path)
+    if rows is not None and type(rows) != range:
+        rows = range(*rows)
+    
+    def selector(index, name, inst_species, inst_family):
+        return ((rows is None or index in rows)
+                and (species is None or inst_species in species) and inst_species not in exclude_species
+                and (families is None or inst_family in families) and inst_family not in exclude_families)
+    
+    with open_data(source_path, mode='r') as source_file:
+        reader = ChemJSONReader(source_file)
+        chem_data = list(reader.instances(selector))
+    
+    json_data = reader.header
+    json_data['chem_data'] = build_instances(chem_data, json_data, dtype=dtype)
+    json_data['species'], json_data['species_count'] = ordered_and_counted(instance.species for instance in json_data['chem_data'])
+    json_data['families'], json_data['family_count'] = ordered_and_counted(instance.family for instance in json_data['chem_data'])
+    if 'species_stats' in json_data: # only aggregate over the instances actually present (of which there may be none)
+        json_data['species_stats'], json_data['family_stats'] = dataset_stats(json_data['chem_data'], dtype=json_data.get('dtype')) if json_data['chem_data'] else ({}, {})
+    return json_data
+
+@instrumented('jsonize')
+def jsonize(source_path, correct_names=False, dtype=None): 
     '''Process spectral data csvs, generating labels, vector mappings, species counts, and other information,
-    then cast the data to a json for ease of data reading in other applications and methods'''
+    then cast the data to a json for ease of data reading in other applications and methods. If a dtype (e.g. "float32") is
+    given, the spectra are stored at that precision and the dtype is recorded in the dataset, to be carried through loading and transforms'''
     source_path = sanitized_path(source_path, ext='.csv')
     rep_flags = {'MIBK' : 'Methyl-iBu-Ketone', # dictionary of names to flag and replace to ensure total consistency of naming between files
                 'Propanol' : '1-Propanol',     # add flags as they come up, these are the ones for Modes 1-3 I've come across so far
@@ -156,7 +660,7 @@ def jsonize(source_path, correct_names=False):
                 'Sec Butyl Acetate' : 'Sec-Butyl Acetate',
                 'Secbutyl Acetate'  : 'Sec-Butyl Acetate'} 
     temp_dict = {}
-    with source_path.open() as csv_file:
+    with open_data(source_path) as csv_file:
         for row in csv.reader(csv_file):
             name, spectrum = row[0], [float(i) for i in row[1:]] # isolate the instance name and spectrum for ease of reference
             if correct_names:
@@ -171,10 +675,15 @@ def jsonize(source_path, correct_names=False):
                 
             temp_dict[name] = spectrum # if all checks and corrections are passed, map the name to the spectrum
     
-    species, species_count = ordered_and_counted(isolate_species(instance) for instance in temp_dict.keys())
-    families, family_count = ordered_and_counted(get_family(instance) for instance in temp_dict.keys())      
-    family_mapping = one_hot_mapping(families)  # dict of onehot mapping vectors by family   
-    chem_data = [(name, isolate_species(name), get_family(name), spectrum, family_mapping[get_family(name)]) for name, spectrum in temp_dict.items()] 
+    if dtype: # cast all spectra to the requested precision at once
+        temp_dict = dict(zip(temp_dict.keys(), np.array(list(temp_dict.values()), dtype=dtype)))
+    
+    with stage('regex classification'): # timed as one stage, as per-call instrumentation of the (very frequently called) helpers would dwarf their cost
+        species, species_count = ordered_and_counted(isolate_species(instance) for instance in temp_dict.keys())
+        families, family_count = ordered_and_counted(get_family(instance) for instance in temp_dict.keys())      
+        family_mapping = one_hot_mapping(families)  # dict of onehot mapping vectors by family   
+        chem_data = [(name, isolate_species(name), get_family(name), spectrum, family_mapping[get_family(name)]) for name, spectrum in temp_dict.items()] 
+    species_stats, family_stats = dataset_stats(chem_data) # point-wise aggregates, precomputed so plotting and inspection needn't recompute them
     
     packaged_data = {   # package all the data into a single dict for json dumping
         'chem_data' : chem_data,
@@ -183,34 +692,334 @@ def jsonize(source_path, correct_names=False):
         'family_mapping' : family_mapping,
         'spectrum_size'  : spectrum_size,
         'species_count'  : species_count,
-        'family_count'   : family_count
+        'family_count'   : family_count,
+        'species_stats'  : species_stats,
+        'family_stats'   : family_stats
     }
+    if dtype:
+        packaged_data['dtype'] = np.dtype(dtype).name
     
-    dest_path = source_path.parent/f'{source_path.stem}{correct_names and "(@)" or ""}.json' # add indicator to target name if correcting names
+    dest_path = derived_path(source_path, correct_names and "(@)" or "") # add indicator to target name if correcting names, keep the source's compression
     dest_path.touch() # create the new file
-    with dest_path.open(mode='w') as json_file:
-        json.dump(packaged_data, json_file) # dump our data into a json file with the same name as the original datacsv
+    with open_data(dest_path, mode='w') as json_file:
+        json.dump(packaged_data, json_file, default=serialized) # dump our data into a json file with the same name as the original datacsv
         
 def csvize(source_path):
     '''Inverse of jsonize, takes a processed chemical data json file and reduces it to a csv with just the listed spectra'''
     source_path = sanitized_path(source_path)
     json_data = load_chem_json(source_path)
-    dest_path = source_path.parent/f'{source_path.stem}(C).csv' # add "C" indicator to denote that this file has been csvized
+    dest_path = derived_path(source_path, '(C)', ext='.csv') # add "C" indicator to denote that this file has been csvized
     dest_path.touch()
-    with dest_path.open(mode='w', newline='') as dest_file:
+    with open_data(dest_path, mode='w', newline='') as dest_file:
         for instance in json_data['chem_data']:
             csv.writer(dest_file).writerow([instance.name, *instance.spectrum]) # merge name and spectral data into a single row and write it to the csv
 
+def binarize(source_path, dtype=None):
+    '''Exports a chemical data json to a binary .npz archive, with all spectra in a single array of the given dtype (by default, that recorded
+    in the dataset, or float64), the instance labels and vectors as columns, and all remaining dataset fields as a json header. The bit width 
+    is given in the name (e.g. "(BIN32)"), so exports at different precisions coexist. Returns the path of the archive. NOTE: only this binary 
+    form halves storage at float32; float32 json is barely smaller than float64, as its values are still written out as decimal text'''
+    source_path = sanitized_path(source_path)
+    json_data = load_chem_json(source_path, dtype=dtype)
+    names, species, families, spectra, vectors = zip(*json_data.pop('chem_data'))
+    json_data['dtype'] = np.dtype(dtype or json_data.get('dtype', 'float64')).name
+    
+    dest_path = source_path.parent/f'{data_stem(source_path)}(BIN{8*np.dtype(json_data["dtype"]).itemsize}).npz' # npz archives are not wrapped in further compression
+    np.savez(dest_path, spectra=np.array(spectra, dtype=json_data['dtype']), names=np.array(names), species=np.array(species),
+             families=np.array(families), vectors=np.array(vectors, dtype='int8'), header=np.array(json.dumps(json_data, default=serialized)))
+    return dest_path
+    
+def load_chem_npz(source_path):
+    '''Reads a binary archive made by binarize() and returns its contents in the same form as load_chem_json() does, with spectra as rows of a single array'''
+    source_path = sanitized_path(source_path, ext='.npz')
+    with np.load(source_path, allow_pickle=False) as archive:
+        json_data = json.loads(str(archive['header']))
+        json_data['chem_data'] = [Instance(str(name), str(species), str(family), spectrum, vector.tolist())
+                                      for name, species, family, spectrum, vector in zip(archive['names'], archive['species'], archive['families'], archive['spectra'], archive['vectors'])]
+    return json_data
+
 def get_by_filetype(extension, path=Path.cwd()):  
     '''Get all files of a particular file type present in a given directory, (the current directory by default)'''
     if type(path) == str:
         path = Path(path) # convert any string input (i.e. just the name) into Path object
     
-    filetypes_present = tuple(file.stem for file in path.iterdir() if file.suffix == extension)
+    filetypes_present = tuple(dict.fromkeys(data_stem(file) for file in path.iterdir() if data_suffix(file) == extension)) # compressed files are listed by their data name
     if filetypes_present == ():
         filetypes_present = (None,)
     return filetypes_present
 
+class DatasetCatalog:
+    '''Catalog of the chemical datasets in a folder, which caches only their header fields (species, families, counts, spectrum size, lineage).
+    Entries are keyed by file name and validated against file modification time and size, so each dataset is only fully parsed the first time
+    it is seen (or after it changes); the cache persists in a file within the folder, so subsequent listings are near-instant'''
+    header_fields = ('species', 'families', 'species_count', 'family_count', 'spectrum_size', 'dtype', 'lineage')
+    cache_name = '.dataset_catalog.cache' # not a .json, so that the cache itself is never listed as a dataset
+    
+    def __init__(self, data_path=Path.cwd(), ext='.json'):
+        self.data_path = Path(data_path)
+        self.cache_path = self.data_path/self.cache_name
+        self.ext = ext
+        self.entries = {}
+        if self.cache_path.exists():
+            try:
+                with self.cache_path.open() as cache_file:
+                    self.entries = json.load(cache_file)
+            except ValueError: # a corrupt cache is simply rebuilt
+                self.entries = {}
+    
+    @staticmethod
+    def read_header(path):
+        '''Extracts the header fields of a dataset without parsing any spectra, inferring its lineage from the indicators in its name if none
+        is recorded. Raises a KeyError for jsons which are not chemical datasets (i.e. have no "chem_data")'''
+        with open_data(path, mode='r') as source_file:
+            reader = ChemJSONReader(source_file)
+            for _ in reader.instances(selector=lambda *args : False): # every instance is skipped over, but still counted
+                pass
+        if reader.instance_count is None:
+            raise KeyError('chem_data')
+        header = {field : reader.header[field] for field in DatasetCatalog.header_fields if field in reader.header}
+        header['instance_count'] = reader.instance_count
+        header.setdefault('lineage', name_lineage(path))
+        return header
+    
+    def refresh(self):
+        '''Re-scan the folder, reading headers only for new or modified datasets and dropping those which no longer exist'''
+        changed, present = False, set()
+        for file in self.data_path.iterdir():
+            if data_suffix(file) != self.ext or not file.is_file():
+                continue
+            present.add(file.name)
+            stat = file.stat()
+            entry = self.entries.get(file.name)
+            if not entry or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                try:
+                    header = self.read_header(file)
+                except (KeyError, ValueError, OSError) as error: # other jsons in the folder (or unreadable datasets) are left out of the catalog
+                    logging.warning(f'Skipping "{file.name}" in dataset catalog: {type(error).__name__}: {error}')
+                    present.discard(file.name)
+                    continue
+                self.entries[file.name] = {'mtime' : stat.st_mtime_ns, 'size' : stat.st_size, 'name' : data_stem(file), **header}
+                changed = True
+                
+        for file_name in set(self.entries) - present:
+            del self.entries[file_name]
+            changed = True
+            
+        if changed:
+            with self.cache_path.open(mode='w') as cache_file:
+                json.dump(self.entries, cache_file)
+        return self
+    
+    def names(self):
+        '''Returns the names of all datasets in the folder (refreshing first), in the same form as get_by_filetype() for use in option menus'''
+        self.refresh()
+        return tuple(dict.fromkeys(entry['name'] for entry in self.entries.values())) or (None,)
+    
+    def info(self, name):
+        '''Returns the cached header of a dataset by name (compressed versions included), or None if no such dataset is catalogued'''
+        for entry in self.entries.values():
+            if entry['name'] == name:
+                return entry
+            
+    def describe(self, name):
+        '''One-line summary of a catalogued dataset'''
+        entry = self.info(name)
+        if not entry:
+            return ''
+        lineage = ' '.join(entry['lineage']) or 'untransformed'
+        return f'{len(entry["species"])} species, {len(entry["families"])} families, {entry["instance_count"]} instances, {entry["spectrum_size"]} pts; {lineage}'
+
+# learn/test splitting and prediction reading, shared by the GUI and the sweep orchestrator
+def split_and_write(chem_data, file_dir, split_prop, unfamiliars=(), label_compression=''):
+    '''Randomly splits instances between NeuralWare learn and test files in a folder, so that each species has (to a rational approximation) the 
+    proportion "split_prop" of its instances in the learn file, except for any unfamiliar species, which are placed wholly in the test file. The names of
+    the instances in each file are written, in order, to "Learn Labels.json" and "Test Labels.json". Returns the lists of learn and test labels'''
+    file_dir = Path(file_dir)
+    split_complement = round(1 - split_prop, 4)   # rounding to 4 places should avoid float error for typical proportions (noted here for future debugging)
+    species_count = collections.Counter(instance.species for instance in chem_data)
+    species_to_keep = {species : random_partitioner(1 if species in unfamiliars else split_complement, count) # create iterators to randomly partition
+                             for species, count in species_count.items()} # each species among the learn and test files, with the proportion specified
+    
+    learn_labels, test_labels = [], []
+    with open(file_dir/'TTT_testfile.txt', 'w') as test_file, open(file_dir/'LLL_learnfile.txt', 'w') as learn_file:    
+        for instance in chem_data:               
+            stringy_data = map(str, [*instance.spectrum, *instance.vector])  # unpack the data into a single long list of strings
+            formatted_entry = '\t'.join(stringy_data) + '\n' #f'!{instance.name}\n' # tab-separate the data and append the name as a comment (!-delimited) with newline
+
+            if next(species_to_keep[instance.species]):  # pull out terms from random bool iter assigned to each instance to determine where to place it
+                test_labels.append(instance.name)
+                test_file.write(formatted_entry)
+            else:
+                learn_labels.append(instance.name)
+                learn_file.write(formatted_entry) 
+                       
+    with open_data(file_dir/f'Test Labels.json{label_compression}', 'w') as test_labels_file, open_data(file_dir/f'Learn Labels.json{label_compression}', 'w') as learn_labels_file: 
+        json.dump(test_labels, test_labels_file)    # write the labels associated with each file to jsons for records and later access if replotting
+        json.dump(learn_labels, learn_labels_file)
+    return learn_labels, test_labels
+
+@instrumented('reading predictions')
+def read_predictions(file_dir, family_mapping):
+    '''Reads in the assigned prediction values from the nnr in a folder, matches them to the names in the test labels file, and returns them 
+    organized hierarchically, by family then species then instance name'''
+    file_dir = Path(file_dir)
+    predictions = {}
+    with open(file_dir/'TTT_testfile_txt.nnr', 'r') as result_file, open_data(resolve_data_path(file_dir/'Test Labels.json'), 'r') as test_labels_file:         
+        for row, inst_name in zip(result_file, json.load(test_labels_file)):
+            readable_row = [float(i) for i in row.split('\t')[1:]] # get rid of tabs, newlines, and other NW garbage output and convert to numerical values #ANCHOR
+            vector = [int(i) for i in readable_row[:len(family_mapping)]]      
+            aavs   = readable_row[len(family_mapping):]
+
+            species, family = isolate_species(inst_name), get_family(inst_name)
+            if family_mapping[family] != vector:
+                raise ValueError(f'NeuralWare has mislabelled {inst_name} ({vector} rather than {family_mapping[family]})')
+
+            if not predictions.get(family): # ensure family key exists
+                predictions[family] = {}
+            if not predictions[family].get(species): # ensure species key exists
+                predictions[family][species] = {}
+            predictions[family][species][inst_name] = aavs # write predictions values to appropriate place in hierarchy
+    
+    return predictions
+
+def species_scores(predictions, family_mapping, precision=4):
+    '''Takes hierarchical predictions (see read_predictions()) and returns the score of each species, i.e. the proportion of its instances whose true 
+    family is assigned the highest activation (the same score as reported on the Fermi plots)'''
+    scores = {}
+    for family, species_dat in predictions.items():
+        hotbit = family_mapping[family].index(1)
+        for species, inst_dat in species_dat.items():
+            n_correct = sum(max(aavs) == aavs[hotbit] for aavs in inst_dat.values())
+            scores[species] = round(n_correct/len(inst_dat), precision)
+    return scores
+
+class ResultsTable:
+    '''Column-oriented store for tabulating results (e.g. scores or metrics across many training runs). Adding a column costs only the length
+    of that column: in memory, and (if the table is backed by a file) as a single appended line, rather than a rewrite of the whole table as with
+    add_csv_column(). Column lengths are validated, and a csv of the full table can be exported on demand'''
+    def __init__(self, store_path=None):
+        self.columns = {}
+        self.store_path = store_path and Path(store_path)
+        if self.store_path and self.store_path.exists():
+            with open_data(self.store_path) as store_file:
+                for line in store_file:
+                    entry = json.loads(line)
+                    self.columns.pop(entry['name'], None) # later entries for a name supersede earlier ones, and move the column to the end as add_column() does
+                    self.columns[entry['name']] = entry['values']
+    
+    def __len__(self):
+        '''Number of rows in the table'''
+        return len(next(iter(self.columns.values()), ()))
+    
+    def __getitem__(self, name):
+        return self.columns[name]
+    
+    def __contains__(self, name):
+        return name in self.columns
+    
+    def add_column(self, name, values, replace=False):
+        '''Append a column to the table. Raises a ValueError if its length doesn't match the existing columns, or if a column 
+        of the same name already exists (unless "replace" is set, in which case the old column is superseded)'''
+        values = list(values)
+        if self.columns and len(values) != len(self):
+            raise ValueError(f'Column "{name}" has {len(values)} entries, table has {len(self)} rows')
+        elif name in self.columns and not replace:
+            raise ValueError(f'Column "{name}" already exists')
+            
+        self.columns.pop(name, None) # a replaced column moves to the end, both here and when the table is read back from file
+        self.columns[name] = values
+        if self.store_path:
+            with open_data(self.store_path, mode='a') as store_file:
+                store_file.write(json.dumps({'name' : name, 'values' : values}, default=serialized) + '\n')
+    
+    def rows(self):
+        '''Iterator over the rows of the table, as tuples ordered as the columns are'''
+        return zip(*self.columns.values())
+    
+    def to_csv(self, csv_path):
+        '''Export the whole table to a csv, with the column names as a header row'''
+        with open_data(csv_path, mode='w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(self.columns.keys())
+            writer.writerows(self.rows())
+
+class AsyncWriteError(Exception):
+    '''Raised by AsyncWriter.barrier() if any background write failed; "errors" holds (description, exception) pairs for each failure'''
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f'{len(errors)} write(s) failed: ' + '; '.join(f'{description} ({error!r})' for description, error in errors))
+
+class AsyncWriter:
+    '''Performs output writes (plot encoding, result files) on a thread pool, so that the caller can carry on producing output in the meantime.
+    At most "max_pending" writes may be outstanding at once; submitting beyond that blocks until one finishes, which caps the memory held by
+    queued figures and data. Failures do not interrupt the caller, but are collected and reported by barrier(). NOTE : by default only one 
+    worker is used, as matplotlib's font cache is not thread-safe, so figures should never be encoded concurrently with one another'''
+    def __init__(self, max_workers=1, max_pending=4):
+        from concurrent.futures import ThreadPoolExecutor # deferred, as the writer is only needed once results are being produced
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='AsyncWriter')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pending = []
+        
+    def submit(self, funct, *args, description=None, **kwargs):
+        '''Queue a call to be made in the background, blocking first if the queue is full. Returns the corresponding Future'''
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(funct, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future : self.slots.release())
+        self.pending.append((description or getattr(funct, '__name__', repr(funct)), future))
+        return future
+    
+    def write_text(self, path, text):
+        '''Write a string to a file in the background (compressed according to the path's suffix, as with open_data())'''
+        return self.submit(write_text, path, text, description=f'"{Path(path).name}"')
+    
+    def write_json(self, path, obj):
+        '''Write a json-serializable object to a file in the background; the object must not be modified until the write is complete'''
+        return self.submit(write_json, path, obj, description=f'"{Path(path).name}"')
+    
+    def barrier(self, raise_errors=True):
+        '''Wait for every write submitted so far to finish. Any failures are raised together as an AsyncWriteError (or returned, if "raise_errors" is False)'''
+        errors = []
+        for description, future in self.pending:
+            error = future.exception() # blocks until the write is done
+            if error is not None:
+                errors.append((description, error))
+        self.pending.clear()
+        
+        if errors and raise_errors:
+            raise AsyncWriteError(errors)
+        return errors
+    
+    def close(self):
+        '''Finish all outstanding writes (raising any failures) and shut down the worker threads'''
+        try:
+            self.barrier()
+        finally:
+            self.executor.shutdown()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else: # don't let write errors mask the original exception
+            self.barrier(raise_errors=False)
+            self.executor.shutdown()
+
+def write_text(path, text):
+    '''Write a string to a (possibly compressed) file'''
+    with open_data(path, mode='w') as dest_file:
+        dest_file.write(text)
+        
+def write_json(path, obj):
+    '''Dump an object to a (possibly compressed) json file'''
+    with open_data(path, mode='w') as dest_file:
+        json.dump(obj, dest_file, default=serialized)
+
 def add_csv_column(csv_path, new_col_data):
     '''Takes a csv path and an iterable of data and appends the data to the csv as the rightmost column.
     If no such csv exists, will create a new csv with a single column consisting of the data passed'''
@@ -248,3 +1057,10 @@ def clear_folder(path):
                 raise PermissionError # convert to permission error (which my file checkers are built to handle)
         else:
             file.unlink()
+
+
+if __name__ == '__main__': # "python iumsutils.py [folder]" lists the datasets in a folder (the current one by default) from the catalog
+    import sys
+    catalog = DatasetCatalog(sys.argv[1] if len(sys.argv) > 1 else Path.cwd())
+    for name in catalog.names():
+        print(f'{name} : {catalog.describe(name)}' if name else 'No datasets found')
@@ -1,7 +1,10 @@
 import cmath
-import numpy as np
 from iumsutils import *
-import matplotlib.pyplot as plt
+from profutils import stage
+
+np  = lazy_import('numpy') # numpy and pyplot are only loaded once a plot is actually made, as they dominate startup time
+plt = lazy_import('matplotlib.pyplot')
+backend_agg = lazy_import('matplotlib.backends.backend_agg')
 
 class Multiplot:
     '''Base class for creating easily referenceable objects to subplot into. Effectively a wrapper for plt.subplots'''
@@ -31,18 +34,33 @@ class Multiplot:
         for i, plot in enumerate(plot_set):
             self.draw(plot, index=i)
         
-    def save(self, file_name, close=True):
-        '''Wrapper for saving Multiplots'''
-        self.fig.savefig(file_name)
+    def save(self, file_name, close=True, writer=None, copies=()):
+        '''Wrapper for saving Multiplots; the same image is also saved to any paths given in "copies". If an AsyncWriter is passed, encoding 
+        and writing happen in the background, in which case the figure is always closed (detached from pyplot) first, so that it is never touched by two threads'''
+        file_names = [file_name, *copies]
+        if writer:
+            plt.close(self.fig)
+            backend_agg.FigureCanvasAgg(self.fig) # give the figure its own non-GUI canvas, so that encoding never touches the GUI backend from a worker thread
+            writer.submit(write_figure, self.fig, file_names, description=f'plot "{Path(file_name).name}"')
+            return
+        
+        with stage('PNG encoding'):
+            for name in file_names:
+                self.fig.savefig(name)
         if close:
             plt.close() # by default, will close plots after saving to prevent clutter of the jupyter window and of memory
+            
+def write_figure(fig, file_names):
+    '''Save a figure to each of the paths given; used as the background task for asynchronous saves'''
+    for name in file_names:
+        fig.savefig(name)
         
-def single_plot(plot_obj, save_dir=None, figsize=20):
+def single_plot(plot_obj, save_dir=None, figsize=20, writer=None):
     '''Boilerplate for creating a 1-panel Multiplot, plotting a particular plot object, and saving it to a desired location'''
     mp = Multiplot(nrows=1, ncols=1, figsize=figsize)
     mp.draw(plot_obj)
     if save_dir:
-        mp.save(save_dir)
+        mp.save(save_dir, writer=writer)
 
     
 # Radar Chart classes
@@ -163,10 +181,10 @@ class Macro_RC(Base_RC):
 # Line Plot classes
 class Line_Plot:
     '''Basic class for plotting lines, allows for multiple lines, scalable x-axis, and moveable legends, within the confines of the Multiplot framework'''
-    def __init__(self, *args, x_range=None, title=None, legend_pos=None, colormap={'line' : 'c'}):
+    def __init__(self, *args, x_range=None, x_data=None, title=None, legend_pos=None, colormap={'line' : 'c'}):
         self.lines = args
-        self.x_data = None
-        if x_range:
+        self.x_data = x_data and list(x_data) # explicit x values, for lines whose points aren't evenly spaced
+        if x_range and not x_data:
             self.x_data = list(np.linspace(*x_range, num=len(self.lines[0]))) # made into list to avoid annoying numpy multi-element truth value error
         
         self.legend_pos = legend_pos
@@ -199,11 +217,12 @@ class PWA_Plot(Line_Plot):
         'Minima' : 'g'
     }
     
-    def __init__(self, spectra, species):
-        self.spectra  = np.array(spectra)
-        self.maxima   = np.amax(self.spectra, axis=0)
-        self.averages = np.average(self.spectra, axis=0)
-        self.minima   = np.amin(self.spectra, axis=0)
+    def __init__(self, spectra, species, stats=None):
+        if stats is None: # precomputed summary statistics (as stored in datasets) can be passed in place of the spectra to avoid re-aggregation
+            stats = summary_stats(spectra, quantiles=())
+        self.maxima   = stats['max']
+        self.averages = stats['mean']
+        self.minima   = stats['min']
         super().__init__(self.maxima, self.averages, self.minima, title=species, legend_pos='upper right', colormap=self.colormap)
         
 class Fermi_Plot(Single_Line_Plot):
@@ -0,0 +1,178 @@
+import cProfile, pstats, json, time, logging, tracemalloc, functools, contextlib, statistics, subprocess, sys
+from pathlib import Path
+
+
+# sinks - any callable which takes a stage name and that stage's record can be passed to Instrumentation.enable() to receive stage reports
+class LogSink:
+    '''Sink which reports the timing and memory of each completed stage through the standard logging module'''
+    def __init__(self, logger_name='NIOBIUMS', level=logging.INFO):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def __call__(self, stage_name, record):
+        self.logger.log(self.level, f'{stage_name} : {record["last_time"]:.4f} s, peak {record["last_peak"]/1024:.1f} KiB (call #{record["calls"]})')
+
+class JSONTraceSink:
+    '''Sink which appends one JSON line per completed stage to a trace file, for later inspection or comparison between runs'''
+    def __init__(self, trace_path):
+        self.trace_path = Path(trace_path)
+
+    def __call__(self, stage_name, record):
+        entry = {'stage' : stage_name, 'wall_time' : record['last_time'], 'peak_memory' : record['last_peak'], 'call' : record['calls'], 'timestamp' : time.time()}
+        with self.trace_path.open(mode='a') as trace_file:
+            trace_file.write(json.dumps(entry) + '\n')
+
+class StatusSink:
+    '''Sink which displays the most recently completed stage in a tkinter widget (e.g. a Label) through its "configure" method'''
+    def __init__(self, widget):
+        self.widget = widget
+
+    def __call__(self, stage_name, record):
+        self.widget.configure(text=f'{stage_name} : {record["last_time"]:.3f} s, {record["last_peak"]/1024**2:.2f} MiB peak')
+
+
+class Instrumentation:
+    '''Class-wide registry of stage timings, call counts, and peak memory usage. Disabled by default, in which case instrumented
+    functions incur only a single attribute check per call. NOTE: stages may be nested; each stage's peak memory is measured relative to its entry'''
+    enabled = False
+    track_memory = True
+    sinks   = []
+    records = {}
+    _memory_stack = [] # pairs of [traced memory upon entry, highest absolute peak of any completed substage] for the currently open stages
+
+    @classmethod
+    def enable(cls, *sinks, track_memory=True):
+        '''Turn on instrumentation, reporting each completed stage to all of the sinks passed'''
+        cls.sinks = list(sinks)
+        cls.track_memory = track_memory
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        cls.enabled = True
+
+    @classmethod
+    def disable(cls):
+        '''Turn off instrumentation; records collected so far are kept until reset() is called'''
+        cls.enabled = False
+        cls._memory_stack.clear()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @classmethod
+    def reset(cls):
+        cls.records.clear()
+
+    @classmethod
+    def record(cls, stage_name, wall_time, peak):
+        '''Update the cumulative record of a stage with the results of one call and pass the record along to the sinks'''
+        record = cls.records.setdefault(stage_name, {'calls' : 0, 'total_time' : 0.0, 'max_time' : 0.0, 'peak_memory' : 0})
+        record['calls'] += 1
+        record['total_time'] += wall_time
+        record['max_time'] = max(record['max_time'], wall_time)
+        record['peak_memory'] = max(record['peak_memory'], peak)
+        record['last_time'], record['last_peak'] = wall_time, peak
+
+        for sink in cls.sinks:
+            sink(stage_name, record)
+
+    @classmethod
+    def summary(cls):
+        '''Returns a plain-text table of all stage records, ordered by total time spent in each stage'''
+        lines = [f'{"Stage":<28}{"Calls":>8}{"Total (s)":>12}{"Max (s)":>10}{"Peak (MiB)":>12}']
+        for stage_name, record in sorted(cls.records.items(), key=lambda item : item[1]['total_time'], reverse=True):
+            lines.append(f'{stage_name:<28}{record["calls"]:>8}{record["total_time"]:>12.4f}{record["max_time"]:>10.4f}{record["peak_memory"]/1024**2:>12.3f}')
+        return '\n'.join(lines)
+
+    @classmethod
+    def dump(cls, dest_path):
+        '''Write all stage records to a json file'''
+        with Path(dest_path).open(mode='w') as dest_file:
+            json.dump(cls.records, dest_file)
+
+
+@contextlib.contextmanager
+def stage(stage_name):
+    '''Context manager which times (and, if enabled, memory-profiles) the enclosed block as one call of the named stage. Does nothing if instrumentation is disabled'''
+    if not Instrumentation.enabled:
+        yield
+        return
+
+    tracing = Instrumentation.track_memory and tracemalloc.is_tracing()
+    stack = Instrumentation._memory_stack
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak) # preserve the enclosing stage's peak so far, as the global peak is about to be reset
+        tracemalloc.reset_peak()
+        stack.append([current, 0])
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start
+        stage_peak = 0
+        if tracing and stack: # stack may have been cleared if instrumentation was disabled mid-stage
+            entry_memory, substage_peak = stack.pop()
+            abs_peak = max(tracemalloc.get_traced_memory()[1], substage_peak)
+            stage_peak = abs_peak - entry_memory
+            if stack:
+                stack[-1][1] = max(stack[-1][1], abs_peak) # propagate this stage's peak to the enclosing stage
+        Instrumentation.record(stage_name, wall_time, stage_peak)
+
+def instrumented(stage_name):
+    '''Decorator which records every call of the decorated function as one call of the named stage'''
+    def decorator(funct):
+        @functools.wraps(funct)
+        def wrapper(*args, **kwargs):
+            if not Instrumentation.enabled: # skip context management entirely when instrumentation is off
+                return funct(*args, **kwargs)
+            with stage(stage_name):
+                return funct(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# cProfile wrappers, for when stage-level granularity is not enough
+@contextlib.contextmanager
+def profiling(stats_path=None, sort='cumulative', nlines=30):
+    '''Run the enclosed block under cProfile. If a path is given the raw stats are dumped there (readable with pstats or snakeviz),
+    otherwise the top "nlines" entries (ordered by "sort") are printed'''
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if stats_path:
+            profiler.dump_stats(str(stats_path))
+        else:
+            pstats.Stats(profiler).sort_stats(sort).print_stats(nlines)
+
+def profiled(funct, *args, stats_path=None, sort='cumulative', nlines=30, **kwargs):
+    '''Call a function with the arguments given under cProfile, returning its result. Stats are handled as in profiling()'''
+    with profiling(stats_path=stats_path, sort=sort, nlines=nlines):
+        return funct(*args, **kwargs)
+
+
+# startup-time measurement, to catch regressions in import cost (particularly from heavy modules sneaking back into module-level imports)
+heavy_modules = ('numpy', 'matplotlib', 'matplotlib.pyplot')
+
+def measure_startup(module_name='NIOBIUMS', nruns=5, cwd=None):
+    '''Times the import of a module in fresh interpreters (so no import caching between runs occurs). Returns a dict with the median and
+    individual import times (in seconds) and which of the heavy modules (numpy, matplotlib) were pulled in by the import'''
+    probe = (f'import sys, time, json; start = time.perf_counter(); import {module_name}; elapsed = time.perf_counter() - start;'
+             f'print(json.dumps([elapsed, [mod for mod in {heavy_modules!r} if mod in sys.modules]]))')
+    times = []
+    for _ in range(nruns):
+        output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True, cwd=cwd).stdout
+        elapsed, loaded = json.loads(output.splitlines()[-1])
+        times.append(elapsed)
+    return {'module' : module_name, 'median_time' : statistics.median(times), 'times' : times, 'heavy_modules_loaded' : loaded}
+
+if __name__ == '__main__': # "python profutils.py [module names]" reports startup costs, exiting with an error if any heavy module is loaded eagerly
+    failed = False
+    for module_name in (sys.argv[1:] or ('NIOBIUMS', 'datautils', 'plotutils')):
+        result = measure_startup(module_name, cwd=Path(__file__).parent)
+        failed = failed or bool(result['heavy_modules_loaded'])
+        print(f'{module_name:<12} {1000*result["median_time"]:8.1f} ms   eagerly loaded: {", ".join(result["heavy_modules_loaded"]) or "none"}')
+    sys.exit(failed)
@@ -0,0 +1,127 @@
+import hashlib, itertools, json, os, random, shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import iumsutils
+import datautils
+import trainutils
+
+
+# parameter sweeps over preprocessing, splitting and built-in classification, run in parallel with cached intermediate datasets
+def expand_steps(steps):
+    '''Takes a sequence of (transform name, parameter grid) pairs, where each grid maps the transform's parameter names to lists of values to try,
+    and returns every pipeline, i.e. each combination of one parameter setting per step, as a tuple of (transform name, parameter items) pairs.
+    Parameters are kept as tuples of (name, value) pairs, rather than dicts, so that pipelines and their prefixes are hashable'''
+    step_options = []
+    for transform_name, grid in steps:
+        if not hasattr(datautils, transform_name):
+            raise ValueError(f'No transform named "{transform_name}" in datautils')
+        names = list(grid)
+        step_options.append([(transform_name, tuple(zip(names, values))) for values in itertools.product(*(grid[name] for name in names))])
+    return list(itertools.product(*step_options))
+
+def describe_pipeline(pipeline):
+    '''Readable one-line description of a pipeline, e.g. "fourier_filterize(cutoff=20) > intensity_filterize(cutoff=0.3)"'''
+    return ' > '.join(f'{name}({", ".join(f"{param}={value}" for param, value in params)})' for name, params in pipeline) or 'untransformed'
+
+def cache_key(*parts):
+    '''Stable short hash of any json-serializable description of a pipeline stage'''
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def run_step(source_path, step_dir, transform_name, params):
+    '''Applies one transform to a dataset within its own folder (so that transforms whose indicators don't reflect all of their parameters never
+    overwrite one another), recording the output in a manifest so that the step can be reused by later pipelines and sweeps. Returns the output path'''
+    step_dir.mkdir(parents=True, exist_ok=True)
+    local_source = step_dir/source_path.name
+    try:
+        os.link(source_path, local_source) # transforms write alongside their input, so the input is (cheaply) linked into the step's folder
+    except OSError:
+        shutil.copyfile(source_path, local_source)
+
+    dest_path = None
+    try:
+        dest_path = getattr(datautils, transform_name)(local_source, **dict(params))
+    finally:
+        if dest_path != local_source: # transforms which leave the data unchanged (e.g. positivize() of positive data) return their input, which is then kept as the output
+            local_source.unlink()
+    if not isinstance(dest_path, Path):
+        raise ValueError(f'{transform_name}{dict(params)} did not produce a dataset ({dest_path!r}); only transforms which return their output path can be swept')
+
+    with (step_dir/'step.json').open('w') as manifest:
+        json.dump({'transform' : transform_name, 'params' : dict(params), 'output' : dest_path.name}, manifest, default=str)
+    return dest_path
+
+def cached_step(step_dir):
+    '''Returns the output of a previously completed step, if both its manifest and output still exist'''
+    manifest_path = step_dir/'step.json'
+    if manifest_path.exists():
+        with manifest_path.open() as manifest:
+            dest_path = step_dir/json.load(manifest)['output']
+        if dest_path.exists():
+            return dest_path
+
+def evaluate(dataset_path, run_dir, split_prop, classifier, seed, unfamiliars=()):
+    '''Splits a dataset, trains and predicts with a built-in classifier, and scores the predictions. The metrics are cached in the run's folder'''
+    metrics_path = run_dir/'metrics.json'
+    if metrics_path.exists():
+        with metrics_path.open() as metrics_file:
+            return json.load(metrics_file)
+
+    run_dir.mkdir(parents=True, exist_ok=True)
+    json_data = iumsutils.load_chem_json(dataset_path)
+    random.seed(seed) # the split is the only random element, and is made reproducible per run
+    iumsutils.split_and_write(json_data['chem_data'], run_dir, split_prop, unfamiliars=unfamiliars)
+    accuracy = trainutils.train_and_predict(run_dir, len(json_data['family_mapping']), classifier=classifier, seed=seed)
+    scores = iumsutils.species_scores(iumsutils.read_predictions(run_dir, json_data['family_mapping']), json_data['family_mapping'])
+
+    familiar_scores = [score for species, score in scores.items() if species not in unfamiliars]
+    if not familiar_scores: # a run is ranked by its familiar species' scores, so there must be some
+        raise ValueError(f'No familiar species were scored in {dataset_path.name}; at least one species must not be unfamiliar')
+    metrics = {'accuracy' : accuracy, 'mean_score' : iumsutils.average(familiar_scores), 'min_score' : min(familiar_scores), 'instances' : len(json_data['chem_data'])}
+    with metrics_path.open('w') as metrics_file:
+        json.dump(metrics, metrics_file)
+    return metrics
+
+def sweep(source_path, steps=(), split_props=(0.8,), classifiers=('softmax',), seeds=(0,), unfamiliars=(), cache_dir=None, max_workers=None):
+    '''Runs every combination of transform parameters (see expand_steps()), split proportion, classifier and seed through transform, split,
+    classification and scoring, in a pool of processes. Each distinct pipeline prefix is only ever computed once: prefixes are run level by level
+    (all first steps in parallel, then all second steps, and so on), and completed steps and runs are cached in "cache_dir" across sweeps.
+    Returns a ResultsTable of all runs ranked by mean species score (ties broken by accuracy), which is also exported to "Sweep Results.csv"'''
+    source_path = iumsutils.sanitized_path(source_path)
+    cache_dir = Path(cache_dir or source_path.parent/f'{iumsutils.data_stem(source_path)} Sweep')
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    if not set(iumsutils.read_chem_header(source_path)['species']) - set(unfamiliars): # fail before any work is done, rather than in every run
+        raise ValueError('Every species is unfamiliar; at least one species must be familiar to score a run')
+    source_stat = source_path.stat()
+    root_key = (source_path.name, source_stat.st_mtime_ns, source_stat.st_size) # cached results are invalidated if the source data changes
+
+    pipelines = expand_steps(steps)
+    outputs = {() : source_path} # dataset path reached by each pipeline prefix
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for depth in range(1, max(map(len, pipelines)) + 1):
+            futures = {}
+            for prefix in {pipeline[:depth] for pipeline in pipelines if len(pipeline) >= depth} - outputs.keys():
+                step_dir = cache_dir/'steps'/cache_key(root_key, prefix)
+                dest_path = cached_step(step_dir)
+                if dest_path:
+                    outputs[prefix] = dest_path
+                else:
+                    futures[prefix] = executor.submit(run_step, outputs[prefix[:-1]], step_dir, *prefix[-1])
+            outputs.update((prefix, future.result()) for prefix, future in futures.items())
+
+        runs = list(itertools.product(pipelines, split_props, classifiers, seeds))
+        futures = [executor.submit(evaluate, outputs[pipeline], cache_dir/'runs'/cache_key(root_key, pipeline, split_prop, classifier, seed, sorted(unfamiliars)),
+                                   split_prop, classifier, seed, tuple(unfamiliars)) for pipeline, split_prop, classifier, seed in runs]
+        results = [future.result() for future in futures]
+
+    ranked = sorted(zip(runs, results), key=lambda entry : (entry[1]['mean_score'], entry[1]['accuracy']), reverse=True)
+    table = iumsutils.ResultsTable()
+    table.add_column('Rank', range(1, len(ranked) + 1))
+    table.add_column('Pipeline', [describe_pipeline(pipeline) for (pipeline, *settings), metrics in ranked])
+    for i, setting in enumerate(('Split', 'Classifier', 'Seed'), start=1):
+        table.add_column(setting, [run[i] for run, metrics in ranked])
+    for metric, column in (('mean_score', 'Mean Score'), ('min_score', 'Min Score'), ('accuracy', 'Accuracy'), ('instances', 'Instances')):
+        table.add_column(column, [metrics[metric] for run, metrics in ranked])
+    table.add_column('Dataset', [str(outputs[pipeline].relative_to(cache_dir)) if pipeline else source_path.name for (pipeline, *settings), metrics in ranked])
+    table.to_csv(cache_dir/'Sweep Results.csv')
+    return table
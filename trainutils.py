@@ -0,0 +1,131 @@
+import json
+from pathlib import Path
+from iumsutils import lazy_import, isolate_species, open_data, resolve_data_path
+from profutils import instrumented
+
+np = lazy_import('numpy') # loaded only once training actually takes place, as with the other modules
+
+
+# built-in classifiers, for quick evaluation of preprocessing choices without a round trip through NeuralWare
+class NearestCentroid:
+    '''Classifies spectra by proximity to the mean spectrum of each class. The activation for each class is a softmax over the negative squared
+    distances to the class centroids, scaled by the typical (median) squared distance of the training spectra to their own centroids'''
+    def __init__(self, seed=None): # deterministic, but accepts a seed as every built-in classifier does
+        self.centroids, self.scale = None, 1.0
+
+    def fit(self, X, Y):
+        counts = Y.sum(axis=0)
+        self.centroids = (Y.T @ X)/np.maximum(counts, 1)[:, None] # one matrix product, rather than a mean per class
+        self.scale = np.median(((X - self.centroids[Y.argmax(axis=1)])**2).sum(axis=1)) or 1.0
+        return self
+
+    def predict_proba(self, X):
+        sq_distances = (X**2).sum(axis=1)[:, None] + (self.centroids**2).sum(axis=1)[None, :] - 2*X@self.centroids.T
+        return softmax(-sq_distances/self.scale)
+
+class SoftmaxRegression:
+    '''Multinomial logistic regression, trained by mini-batch gradient descent with L2 regularization. Inputs are standardized by the training
+    set's point-wise mean and deviation, so that the same learning rate works across differently scaled (e.g. transformed) datasets'''
+    def __init__(self, learning_rate=0.5, epochs=200, batch_size=256, l2=1e-4, seed=0):
+        self.learning_rate, self.epochs, self.batch_size, self.l2, self.seed = learning_rate, epochs, batch_size, l2, seed
+        self.weights, self.bias, self.mean, self.std = None, None, None, None
+
+    def standardize(self, X):
+        return (X - self.mean)/self.std
+
+    def fit(self, X, Y):
+        rng = np.random.default_rng(self.seed)
+        self.mean, self.std = X.mean(axis=0), X.std(axis=0)
+        self.std[self.std == 0] = 1.0
+        X = self.standardize(X)
+
+        self.weights, self.bias = np.zeros((X.shape[1], Y.shape[1])), np.zeros(Y.shape[1])
+        for epoch in range(self.epochs):
+            order = rng.permutation(len(X))
+            for start in range(0, len(X), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                error = (softmax(X[batch]@self.weights + self.bias) - Y[batch])/len(batch) # gradient of the mean cross-entropy w.r.t. the logits
+                self.weights -= self.learning_rate*(X[batch].T@error + self.l2*self.weights)
+                self.bias    -= self.learning_rate*error.sum(axis=0)
+        return self
+
+    def predict_proba(self, X):
+        return softmax(self.standardize(X)@self.weights + self.bias)
+
+classifiers = {'centroid' : NearestCentroid, 'softmax' : SoftmaxRegression} # all take a "seed" argument, so that any can be run reproducibly
+
+def softmax(logits):
+    '''Row-wise softmax of a 2D array, shifted by each row's maximum for numerical stability'''
+    exps = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exps/exps.sum(axis=1, keepdims=True)
+
+
+# file I/O in the NeuralWare formats, so that built-in results slot into the existing plotting pipeline
+def read_split_file(split_path, n_outputs):
+    '''Reads a learn or test file (as written by NIOBIUMS: tab-separated spectrum points followed by the one-hot family vector),
+    returns the 2D arrays of spectra and of family vectors'''
+    data = np.loadtxt(split_path, delimiter='\t', ndmin=2)
+    return data[:, :-n_outputs], data[:, -n_outputs:]
+
+def write_nnr(nnr_path, Y, activations):
+    '''Writes predictions in the layout of a NeuralWare .nnr: one row per test instance, consisting of a row index,
+    the expected (one-hot) vector, and the activation of each output, all tab-separated'''
+    with Path(nnr_path).open(mode='w') as nnr_file:
+        for i, (vector, aavs) in enumerate(zip(Y.astype(int).tolist(), activations.tolist()), start=1):
+            nnr_file.write('\t'.join(map(str, (i, *vector, *aavs))) + '\n')
+
+
+# augmentation, to balance under-represented species in a learn file without discarding data as reductize() does
+def drift_shift(spectra, shifts):
+    '''Shifts each spectrum (row) along the drift-time axis by its own integer number of points in one indexing operation, repeating edge values into the vacated points'''
+    indices = np.clip(np.arange(spectra.shape[1])[None, :] - np.asarray(shifts)[:, None], 0, spectra.shape[1] - 1)
+    return np.take_along_axis(spectra, indices, axis=1)
+
+def augment_learnfile(file_dir, n_outputs, target_count=None, noise_scale=0.5, max_shift=1, scale_range=0.05, seed=0, batch_size=256):
+    '''Appends synthetic spectra to the learn file in a training folder until every species has "target_count" learn instances (by default, as many as
+    the best-represented species). Each synthetic spectrum is a randomly chosen real spectrum of the species, shifted by up to "max_shift" points, scaled 
+    in intensity by a factor within 1 +/- "scale_range", and with Gaussian noise added, of "noise_scale" times the species' standard deviation at each point.
+    Spectra are generated "batch_size" at a time and written straight to the file, so the augmented set is never held in memory. The names given to
+    the synthetic instances are written, in file order, to "Augmented Labels.json" (Learn Labels.json continues to list only the real instances).
+    Returns the number of synthetic instances added for each species'''
+    file_dir = Path(file_dir)
+    rng = np.random.default_rng(seed)
+    X, Y = read_split_file(file_dir/'LLL_learnfile.txt', n_outputs)
+    with open_data(resolve_data_path(file_dir/'Learn Labels.json')) as labels_file:
+        species_names, codes = np.unique([isolate_species(name) for name in json.load(labels_file)], return_inverse=True)
+    if len(codes) != len(X):
+        raise ValueError(f'Learn file has {len(X)} rows but {len(codes)} labels; has it already been augmented?')
+    
+    counts = np.bincount(codes, minlength=len(species_names))
+    means = (np.eye(len(species_names))[codes].T @ X)/counts[:, None] # grouped point-wise moments, via the one-hot matrix of species codes
+    stds = np.sqrt(np.maximum((np.eye(len(species_names))[codes].T @ X**2)/counts[:, None] - means**2, 0))
+    target_count = target_count or counts.max()
+    
+    deficits = np.maximum(target_count - counts, 0)
+    source_rows = np.concatenate([rng.choice(np.flatnonzero(codes == code), size=deficit) for code, deficit in enumerate(deficits) if deficit] or [np.empty(0, dtype=int)])
+    aug_labels = [f'{species} (augmented) {i}' for species, deficit in zip(species_names, deficits) for i in range(1, deficit + 1)]
+    with (file_dir/'LLL_learnfile.txt').open(mode='a') as learn_file:
+        for start in range(0, len(source_rows), batch_size):
+            rows = source_rows[start:start + batch_size]
+            spectra = drift_shift(X[rows], rng.integers(-max_shift, max_shift + 1, size=len(rows)))
+            spectra = spectra*rng.uniform(1 - scale_range, 1 + scale_range, size=(len(rows), 1)) + noise_scale*stds[codes[rows]]*rng.standard_normal(spectra.shape)
+            for spectrum, vector in zip(spectra.tolist(), Y[rows].astype(int).tolist()):
+                learn_file.write('\t'.join(map(str, (*spectrum, *vector))) + '\n')
+                
+    with (file_dir/'Augmented Labels.json').open(mode='w') as aug_labels_file:
+        json.dump(aug_labels, aug_labels_file)
+    return {str(species) : int(deficit) for species, deficit in zip(species_names, deficits) if deficit}
+
+@instrumented('training')
+def train_and_predict(file_dir, n_outputs, classifier='softmax', **classifier_args):
+    '''Trains one of the built-in classifiers on the learn file in a training folder, predicts over the test file, and writes the predictions
+    to "TTT_testfile_txt.nnr" there, exactly where NeuralWare's would go. Returns the test accuracy (the proportion of test instances whose
+    highest activation is for their own family)'''
+    file_dir = Path(file_dir)
+    X_learn, Y_learn = read_split_file(file_dir/'LLL_learnfile.txt', n_outputs)
+    X_test, Y_test = read_split_file(file_dir/'TTT_testfile.txt', n_outputs)
+
+    model = classifiers[classifier](**classifier_args).fit(X_learn, Y_learn)
+    activations = model.predict_proba(X_test)
+    write_nnr(file_dir/'TTT_testfile_txt.nnr', Y_test, activations)
+    return float((activations.argmax(axis=1) == Y_test.argmax(axis=1)).mean())